@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+"""Benchmark harness for the render pipeline of main.py.
+
+Starts a local fixture site (one first-party host and several third-party hosts, each
+with its own robots.txt), runs run_playwright_test_suite in several modes and writes
+wall time, renders/minute, peak RSS (including Chromium processes), per-test and per-phase latency and route-callback
+overhead to a JSON file that can be compared across commits.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --output bench_new.json --compare bench.json
+
+--startup measures cold start instead: import time and RSS of main.py, and the time until
+the web server answers its first request.
+
+    python benchmark.py --startup --output startup.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import socket
+import statistics
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# --- Benchmark Modes ---
+# name -> settings applied to main.py before running the suite
+MODES = {
+    "discover-c5": {"discover": True, "concurrency": 5, "workers": 1},
+    "discover-c10": {"discover": True, "concurrency": 10, "workers": 1},
+    "discover-w2": {"discover": True, "concurrency": 5, "workers": 2},
+    "predefined-c5": {"discover": False, "concurrency": 5, "workers": 1},
+}
+
+# 1x1 transparent PNG
+PIXEL_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489"
+    "0000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+# --- Fixture Site ---
+def make_fixture_handler(config, hosts):
+    """Builds the request handler serving synthetic pages, resources and robots.txt."""
+
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass # Keep the benchmark output readable
+
+        def _send(self, body, content_type, status=200):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            query = parse_qs(parsed.query)
+            if parsed.path == "/robots.txt":
+                # Every host disallows its /private/ resources for Googlebot
+                self._send(b"User-agent: Googlebot\nDisallow: /private/\n\nUser-agent: *\nAllow: /\n", "text/plain")
+            elif parsed.path == "/page":
+                self._send(self._render_page().encode(), "text/html; charset=utf-8")
+            elif parsed.path.startswith("/slow"):
+                time.sleep(config["slow_ms"] / 1000)
+                self._send(b"/* slow */", "application/javascript")
+            elif parsed.path.startswith("/poll"):
+                # Long-polling endpoint: holds the connection open before answering
+                time.sleep(config["long_poll_ms"] / 1000)
+                self._send(b'{"events": []}', "application/json")
+            elif parsed.path.endswith(".js"):
+                self._send(f"document.body.insertAdjacentHTML('beforeend', '<p>script {query.get('v', ['?'])[0]}</p>');".encode(), "application/javascript")
+            elif parsed.path.endswith(".css"):
+                self._send(b"body { margin: 0; padding: 8px; }", "text/css")
+            elif parsed.path.endswith(".png"):
+                self._send(PIXEL_PNG, "image/png")
+            else:
+                self._send(b"not found", "text/plain", status=404)
+
+        def _render_page(self):
+            tags = []
+            for i in range(config["resources"]):
+                host = hosts[i % len(hosts)]
+                private = "private/" if i % 4 == 0 else ""
+                kind = i % 3
+                if kind == 0:
+                    tags.append(f'<script src="{host}/{private}r{i}.js?v={i}"></script>')
+                elif kind == 1:
+                    tags.append(f'<link rel="stylesheet" href="{host}/{private}s{i}.css?v={i}">')
+                else:
+                    tags.append(f'<img src="{host}/{private}i{i}.png?v={i}" width="40" height="40">')
+            if config["slow_ms"]:
+                tags.append(f'<script src="{hosts[0]}/slow.js?ms={config["slow_ms"]}"></script>')
+            if config["long_poll_ms"]:
+                tags.append(f'<script>fetch("{hosts[-1]}/poll?v=1").catch(() => {{}});</script>')
+            rows = "".join(f"<p>Paragraph {i} of the fixture page.</p>" for i in range(50))
+            return f"<!DOCTYPE html><html><head><title>Fixture</title></head><body><h1>Fixture page</h1>{rows}{''.join(tags)}</body></html>"
+
+    return FixtureHandler
+
+class FixtureSite:
+    """Runs one local HTTP server per simulated host (distinct ports are distinct netlocs)."""
+
+    def __init__(self, config):
+        self.config = config
+        self.servers = []
+        self.hosts = []
+
+    def start(self):
+        host_count = 1 + self.config["third_party_hosts"]
+        # Bind first so every handler knows the full host list
+        for _ in range(host_count):
+            server = ThreadingHTTPServer(("127.0.0.1", 0), BaseHTTPRequestHandler)
+            server.daemon_threads = True
+            self.servers.append(server)
+            self.hosts.append(f"http://127.0.0.1:{server.server_address[1]}")
+        handler = make_fixture_handler(self.config, self.hosts)
+        for server in self.servers:
+            server.RequestHandlerClass = handler
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        return f"{self.hosts[0]}/page"
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+# --- Process Tree Memory ---
+def list_process_tree(root_pid):
+    """Returns root_pid and all its descendants (Chromium runs as a grandchild, under the Playwright driver)."""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil:
+        try:
+            root = psutil.Process(root_pid)
+            return [root_pid] + [child.pid for child in root.children(recursive=True)]
+        except psutil.Error:
+            return [root_pid]
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces, the parent pid is the 2nd field after it
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids, pending = [], [root_pid]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children.get(pid, []))
+    return pids
+
+def read_rss_kb(pid):
+    """Current RSS of one process in KB from /proc, or 0 if it is gone."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return 0
+
+class TreeRssSampler:
+    """Samples the summed RSS of this process and all its descendants in a background thread.
+       Shared pages are counted once per process, so this overestimates a little; it is meant
+       for comparisons between runs. Linux only (/proc), or any platform with psutil.
+    """
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.peak_kb = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                total = sum(read_rss_kb(pid) for pid in list_process_tree(os.getpid()))
+            except OSError:
+                return # No /proc and no psutil on this platform
+            self.peak_kb = max(self.peak_kb, total)
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+# --- Single Mode Run (executed in a subprocess) ---
+def run_mode(mode_name, page_url, predefined_patterns):
+    """Runs the test suite once in this process and returns its metrics."""
+    import main
+
+    settings = MODES[mode_name]
+    main.OUTPUT_DIR = tempfile.mkdtemp(prefix=f"bench_{mode_name}_")
+    main.PAGE_URL = page_url
+    main.DISCOVER_MODE = settings["discover"]
+    main.CONCURRENCY = settings["concurrency"]
+    main.WORKERS = settings["workers"]
+    main.PREDEFINED_BLOCK_LIST = predefined_patterns
+
+    start = time.perf_counter()
+    with TreeRssSampler() as rss_sampler:
+        success = asyncio.run(main.run_playwright_test_suite())
+    wall_time = time.perf_counter() - start
+
+    renders = len(main.test_results)
+    # Per-test durations and phase spans are recorded by main.py itself (including sharded tests)
+    durations = sorted(r["duration_ms"] / 1000 for r in main.test_results if r.get("duration_ms") is not None)
+    phases = main.build_timing_summary()
+    route_callbacks = phases.get("route_callback", {})
+
+    def percentile(p):
+        if not durations:
+            return None
+        return round(durations[min(len(durations) - 1, int(p * len(durations)))], 3)
+
+    return {
+        "success": success,
+        "settings": settings,
+        "wall_time_s": round(wall_time, 3),
+        "renders": renders,
+        "errors": sum(1 for r in main.test_results if r["error"]),
+        "renders_per_minute": round(renders / wall_time * 60, 2) if wall_time else None,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, # Python process only
+        "peak_tree_rss_kb": rss_sampler.peak_kb or None, # Python + Playwright driver + Chromium processes
+        "test_latency_s": {"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1.0)},
+        "phase_latency_ms": phases,
+        "route_callbacks": route_callbacks.get("count", 0),
+        "route_callback_overhead_ms": route_callbacks.get("mean_ms"),
+    }
+
+# --- Startup Benchmark ---
+def measure_import():
+    """Imports main in this (fresh) process and returns its import time, RSS and loaded modules."""
+    modules_before = len(sys.modules)
+    start = time.perf_counter()
+    import main # noqa: F401
+    import_time = time.perf_counter() - start
+    return {
+        "import_s": round(import_time, 4),
+        "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "modules_loaded": len(sys.modules) - modules_before,
+        "playwright_loaded": "playwright.async_api" in sys.modules,
+    }
+
+def read_peak_rss_kb(pid):
+    """Peak RSS of a running process from /proc (Linux only), or None."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def measure_server_start(timeout=30):
+    """Starts main.py in production mode and returns the time until / answers, and the server's peak RSS."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    start = time.perf_counter()
+    # Run from a scratch directory so the output directory is not created in the checkout
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"), "--production", "--port", str(port)],
+        cwd=tempfile.mkdtemp(prefix="bench_startup_"), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return {"first_response_s": round(time.perf_counter() - start, 3), "rss_kb": read_peak_rss_kb(server.pid)}
+            except OSError:
+                time.sleep(0.05)
+        return {"error": f"Server did not answer within {timeout}s"}
+    finally:
+        server.terminate()
+        server.wait()
+
+def run_startup_benchmark(runs):
+    """Measures import and server start several times, each in a new process, and keeps the medians."""
+    imports = []
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-startup"], capture_output=True, text=True,
+                                   cwd=tempfile.mkdtemp(prefix="bench_startup_"))
+        result_lines = [line for line in completed.stdout.splitlines() if line.startswith("BENCHMARK_RESULT ")]
+        if completed.returncode != 0 or not result_lines:
+            return {"error": completed.stderr[-2000:]}
+        imports.append(json.loads(result_lines[-1][len("BENCHMARK_RESULT "):]))
+    servers = [measure_server_start() for _ in range(runs)]
+    started = [s for s in servers if "error" not in s]
+    return {
+        "runs": runs,
+        "import_s": statistics.median(i["import_s"] for i in imports),
+        "import_rss_kb": statistics.median(i["rss_kb"] for i in imports),
+        "modules_loaded": imports[-1]["modules_loaded"],
+        "playwright_loaded_at_import": imports[-1]["playwright_loaded"],
+        "server_first_response_s": statistics.median(s["first_response_s"] for s in started) if started else None,
+        "server_rss_kb": statistics.median(s["rss_kb"] for s in started if s["rss_kb"]) if any(s["rss_kb"] for s in started) else None,
+        "server_errors": [s["error"] for s in servers if "error" in s],
+    }
+
+# --- Reporting ---
+def git_revision():
+    """Returns the current commit hash, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+def print_comparison(current, previous):
+    """Prints wall time and throughput (or startup) deltas against a previous benchmark file."""
+    print(f"\n--- Comparison with {previous.get('revision') or 'previous run'} ---")
+    if "startup" in current:
+        for key in ("import_s", "import_rss_kb", "server_first_response_s", "server_rss_kb"):
+            before = previous.get("startup", {}).get(key)
+            after = current["startup"].get(key)
+            if before and after:
+                print(f"  {key}: {before} -> {after} ({(after - before) / before * 100:+.1f}%)")
+            else:
+                print(f"  {key}: no comparable result")
+        return
+    for mode_name, metrics in current["modes"].items():
+        before = previous.get("modes", {}).get(mode_name)
+        if not before or "wall_time_s" not in metrics or "wall_time_s" not in before:
+            print(f"  {mode_name}: no comparable result")
+            continue
+        delta = (metrics["wall_time_s"] - before["wall_time_s"]) / before["wall_time_s"] * 100
+        print(f"  {mode_name}: wall {before['wall_time_s']}s -> {metrics['wall_time_s']}s ({delta:+.1f}%), "
+              f"renders/min {before['renders_per_minute']} -> {metrics['renders_per_minute']}, "
+              f"peak RSS {before.get('peak_tree_rss_kb')} -> {metrics.get('peak_tree_rss_kb')} KB")
+
+# --- Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the resource blocking render pipeline')
+    parser.add_argument('--modes', type=str, default="discover-c5,discover-c10,predefined-c5", help=f"Comma-separated modes among: {', '.join(MODES)}")
+    parser.add_argument('--resources', type=int, default=12, help='Resources per fixture page')
+    parser.add_argument('--third-party-hosts', type=int, default=2, help='Number of simulated third-party hosts')
+    parser.add_argument('--slow-ms', type=int, default=500, help='Delay of the slow endpoint (0 to disable)')
+    parser.add_argument('--long-poll-ms', type=int, default=0, help='Duration of the long-polling request (0 to disable)')
+    parser.add_argument('--output', type=str, default="bench_output.json", help='JSON file receiving the results')
+    parser.add_argument('--compare', type=str, help='Previous JSON results to compare against')
+    parser.add_argument('--startup', action='store_true', help='Measure import time, RSS and server cold start instead of renders')
+    parser.add_argument('--startup-runs', type=int, default=5, help='Fresh processes measured in --startup mode (medians are reported)')
+    parser.add_argument('--run-startup', action='store_true', help=argparse.SUPPRESS) # Internal: import main and print JSON
+    parser.add_argument('--run-mode', type=str, help=argparse.SUPPRESS) # Internal: run one mode and print JSON
+    parser.add_argument('--page-url', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--patterns', type=str, default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_startup:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        print("BENCHMARK_RESULT " + json.dumps(measure_import()))
+        sys.exit(0)
+
+    if args.startup:
+        report = {"revision": git_revision(), "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                  "startup": run_startup_benchmark(max(1, args.startup_runs))}
+        print(json.dumps(report["startup"], indent=2))
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+        if args.compare:
+            with open(args.compare) as f:
+                print_comparison(report, json.load(f))
+        sys.exit(0)
+
+    if args.run_mode:
+        metrics = run_mode(args.run_mode, args.page_url, [p for p in args.patterns.split(",") if p])
+        print("BENCHMARK_RESULT " + json.dumps(metrics))
+        sys.exit(0)
+
+    config = {
+        "resources": args.resources,
+        "third_party_hosts": args.third_party_hosts,
+        "slow_ms": args.slow_ms,
+        "long_poll_ms": args.long_poll_ms,
+    }
+    site = FixtureSite(config)
+    page_url = site.start()
+    print(f"Fixture site running at {page_url} ({len(site.hosts)} hosts)")
+
+    report = {"revision": git_revision(), "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "config": config, "modes": {}}
+    try:
+        for mode_name in [m.strip() for m in args.modes.split(",") if m.strip()]:
+            if mode_name not in MODES:
+                print(f"Unknown mode: {mode_name}")
+                continue
+            print(f"\n--- Running mode {mode_name} ---")
+            # Each mode runs in its own process so peak RSS and globals are not shared
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--run-mode", mode_name, "--page-url", page_url,
+                 "--patterns", ",".join(f"r{i}.js" for i in range(0, args.resources, 3))],
+                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+            )
+            result_lines = [line for line in completed.stdout.splitlines() if line.startswith("BENCHMARK_RESULT ")]
+            if completed.returncode != 0 or not result_lines:
+                print(f"  Mode {mode_name} failed:\n{completed.stderr[-2000:]}")
+                report["modes"][mode_name] = {"error": completed.stderr[-2000:]}
+                continue
+            metrics = json.loads(result_lines[-1][len("BENCHMARK_RESULT "):])
+            report["modes"][mode_name] = metrics
+            status = "" if metrics["success"] else " (suite reported an error)"
+            print(f"  wall {metrics['wall_time_s']}s{status}, {metrics['renders']} renders, "
+                  f"{metrics['renders_per_minute']} renders/min, peak RSS {metrics['peak_tree_rss_kb']} KB "
+                  f"(Python process alone: {metrics['peak_rss_kb']} KB)")
+    finally:
+        site.stop()
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(report, json.load(f))
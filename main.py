@@ -4,17 +4,29 @@ import os
 import re
 import sys
 import argparse # Added import for arguments
-from playwright.async_api import async_playwright, Error as PlaywrightError
 from urllib.parse import urlparse, urlunparse, quote as url_quote
-from flask import Flask, render_template_string, url_for, send_from_directory, abort, request, redirect, jsonify
+from flask import Flask, render_template_string, url_for, send_from_directory, abort, request, redirect, jsonify, Response, stream_with_context
 import logging
 import threading
 import time
-from gpyrobotstxt.robots_cc import RobotsMatcher
+import multiprocessing
+import json
+import sqlite3
+import uuid
+import socket
+import hashlib
+import hmac
+import shutil
+import ipaddress
+from functools import lru_cache
+import csv
+import io
+import zipfile
+from contextlib import contextmanager, AsyncExitStack
+from concurrent.futures import ProcessPoolExecutor
 
 from collections import defaultdict
-from playwright.sync_api import sync_playwright
-import requests
+# playwright, requests, gpyrobotstxt and cProfile are imported on first use to keep startup fast
 
 # --- Configuration ---
 # DISCOVER_MODE will be set by argparse
@@ -22,8 +34,65 @@ import requests
 
 PREDEFINED_BLOCK_LIST = []
 
-OUTPUT_DIR = "screenshots_playwright"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+GOOGLEBOT_SMARTPHONE_UA = "Mozilla/5.0 (Linux; Android 6.0.1; Nexus 5X Build/MMB29P) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/W.X.Y.Z Mobile Safari/537.36 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"
+GOOGLEBOT_DESKTOP_UA = "Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko; compatible; Googlebot/2.1; +http://www.google.com/bot.html) Chrome/W.X.Y.Z Safari/537.36"
+
+# Rendering configurations (keyword arguments of browser.new_context)
+# 'default' keeps the historical setup: smartphone user agent with Playwright's default viewport
+DEVICES = {
+    "default": {"user_agent": GOOGLEBOT_SMARTPHONE_UA},
+    "smartphone": {"user_agent": GOOGLEBOT_SMARTPHONE_UA, "viewport": {"width": 412, "height": 732},
+                   "is_mobile": True, "has_touch": True},
+    "desktop": {"user_agent": GOOGLEBOT_DESKTOP_UA, "viewport": {"width": 1350, "height": 940}},
+}
+DEVICE_MATRIX = ["default"] # Devices each variant is rendered with, set by argparse
+VIEWPORT_WIDTHS = [] # Extra widths captured from the already loaded page, set by argparse
+MOBILE_MAX_WIDTH = 767 # Extra widths are only captured within the device's class (mobile or desktop)
+VIEWPORT_SETTLE_MS = 500 # Wait after a viewport resize before the screenshot
+
+CONCURRENCY = 5 # Individual tests run per batch (per worker process)
+WORKERS = 1 # Worker processes used to shard individual tests, set by argparse
+PROFILE_ENABLED = False # Dump a cProfile of each run to OUTPUT_DIR/profiles, set by argparse
+INCREMENTAL_MODE = False # Reuse results of unchanged resources from the previous run (discovery mode only)
+INCREMENTAL_STATE_FILE = "incremental_state.json" # Stored in OUTPUT_DIR
+SCENARIOS_MODE = False # Also render grouped scenarios (third-party, per type, per host x type), discovery only
+MAX_SCENARIOS = 40 # Upper bound on grouped scenarios rendered per run
+SCENARIO_RESOURCE_TYPES = ["script", "stylesheet", "font", "image", "media", "xhr", "fetch"]
+
+# Per-phase deadlines and retries for flaky navigations
+GOTO_TIMEOUT_MS = 30000 # page.goto until 'networkidle'
+SETTLE_DELAY_MS = 2000 # Wait after load before the screenshot
+SCREENSHOT_TIMEOUT_MS = 20000
+ERROR_SCREENSHOT_TIMEOUT_MS = 5000
+NAV_MAX_RETRIES = 2 # Extra attempts for transient errors (timeout, crash, connection)
+NAV_RETRY_BACKOFF = 1.0 # Seconds before the first retry, doubled on each retry
+CIRCUIT_BREAKER_THRESHOLD = 3 # Consecutive origin-level failures before the run is aborted
+
+# Serving
+CHECK_IMPACT_MAX_PENDING = 4 # Concurrent /check_impact measurements before answering 429
+CHECK_IMPACT_TIMEOUT = 120 # Seconds a /check_impact request waits for its measurement
+SERVER_THREADS = 8 # Request threads of the production server
+
+# Results API and thumbnails
+RESULTS_PER_PAGE_MAX = 100
+THUMBNAIL_WIDTH = 400 # Thumbnails keep the top of the page, cropped to a 2:3 ratio
+THUMBNAIL_DIR = "thumbnails" # Inside OUTPUT_DIR
+
+# Distributed mode: individual tests are queued for remote workers (see WorkQueue)
+QUEUE_LEASE_SECONDS = 60 # A running job without heartbeat for this long is requeued
+QUEUE_MAX_ATTEMPTS = 3 # Attempts per job before it is marked as failed
+QUEUE_STALL_TIMEOUT = 600 # Coordinator gives up if no job finishes for this long
+WORKER_HEARTBEAT_INTERVAL = 10
+WORKER_POLL_INTERVAL = 2
+QUEUE_TOKEN = None # Shared secret workers send in the X-Queue-Token header, set by argparse
+
+# Result export
+RESULTS_JOURNAL_FILE = "results.jsonl" # Appended in OUTPUT_DIR as tests complete, rewritten with impact scores at the end
+EXPORT_FOLLOW_INTERVAL = 1.0 # Seconds between checks for new results when following a running export
+EXPORT_CSV_FIELDS = ["prefix", "device", "blocked_item", "googlebot_allowed", "error", "error_class", "error_message",
+                     "impact_score", "duration_ms", "attempts", "reused", "screenshot_file"]
+
+OUTPUT_DIR = "screenshots_playwright" # Created on first run or when the server starts
 
 # --- Global Variables ---
 test_results = [] # Stores results for Flask display
@@ -34,8 +103,17 @@ PAGE_URL = None # Will be set by argparse or the form
 test_status = "idle" # idle, running, completed, error
 test_log = [] # To store logs for live updates
 predefined_urls = [] # To store the list of URLs to block
+work_queue = None # WorkQueue instance when running as a distributed coordinator
+export_paths = [] # Extra .jsonl/.csv files receiving results as tests complete, set by argparse
+results_journal_enabled = True # Shard processes and remote workers leave the journal to the parent/coordinator
+shard_events = None # In a shard process: queue streaming its results, log lines and breaker trips to the parent
 
 # --- Utility Functions ---
+def async_playwright():
+    """Imports Playwright on first use (the heaviest dependency) and returns its async context manager."""
+    from playwright.async_api import async_playwright as start_playwright
+    return start_playwright()
+
 def sanitize_filename(url_part):
     """Creates a safe filename from a URL or identifier."""
     if not url_part:
@@ -81,15 +159,193 @@ def sanitize_filename(url_part):
     sanitized = re.sub(r'_+', '_', sanitized).strip('._')
     return sanitized[:100] # Limit final length
 
+# --- Timing Spans ---
+phase_stats = defaultdict(lambda: [0, 0.0, 0.0]) # Hot-path phase -> [count, total seconds, max seconds]
+run_timings = [] # Run-level spans (e.g. discovery) of the current run
+
+def record_phase(phase, seconds):
+    """Adds one measurement to the aggregate stats of a hot-path phase."""
+    stats = phase_stats[phase]
+    stats[0] += 1
+    stats[1] += seconds
+    stats[2] = max(stats[2], seconds)
+
+@contextmanager
+def timing_span(timings, phase, origin):
+    """Appends a {phase, start_ms, duration_ms} span to timings; start is relative to origin (perf_counter)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        timings.append({
+            'phase': phase,
+            'start_ms': round((start - origin) * 1000, 1),
+            'duration_ms': round((end - start) * 1000, 1),
+        })
+
+def build_timing_summary(results=None):
+    """Aggregates per-test spans, run-level spans and hot-path stats into one breakdown per phase."""
+    summary = {}
+
+    def add(phase, count, total_ms, max_ms):
+        entry = summary.setdefault(phase, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        entry['count'] += count
+        entry['total_ms'] += total_ms
+        entry['max_ms'] = max(entry['max_ms'], max_ms)
+
+    for result in (test_results if results is None else results):
+        for span in result.get('timings') or []:
+            add(span['phase'], 1, span['duration_ms'], span['duration_ms'])
+    for span in run_timings:
+        add(span['phase'], 1, span['duration_ms'], span['duration_ms'])
+    for phase, (count, total, longest) in list(phase_stats.items()):
+        add(phase, count, total * 1000, longest * 1000)
+
+    for entry in summary.values():
+        entry['total_ms'] = round(entry['total_ms'], 1)
+        entry['max_ms'] = round(entry['max_ms'], 1)
+        entry['mean_ms'] = round(entry['total_ms'] / entry['count'], 2) if entry['count'] else 0.0
+    return dict(sorted(summary.items(), key=lambda item: item[1]['total_ms'], reverse=True))
+
+@contextmanager
+def profiling(label):
+    """Profiles the enclosed code with cProfile when PROFILE_ENABLED, dumping to OUTPUT_DIR/profiles.
+       Only the current thread is profiled (the event loop thread when used around a run).
+    """
+    if not PROFILE_ENABLED:
+        yield
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profile_dir = os.path.join(OUTPUT_DIR, "profiles")
+        os.makedirs(profile_dir, exist_ok=True)
+        profile_path = os.path.join(profile_dir, f"{time.strftime('%Y%m%d_%H%M%S')}_{label}_{os.getpid()}.prof")
+        profiler.dump_stats(profile_path)
+        print(f"Profile saved: {profile_path}")
+
+# --- Metrics (Prometheus text format) ---
+class Metric:
+    """A counter or gauge with optional labels, safe to update from any thread."""
+
+    def __init__(self, name, help_text, metric_type="counter"):
+        self.name = name
+        self.help_text = help_text
+        self.metric_type = metric_type
+        self.values = defaultdict(float) # label tuple -> value
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] += amount
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        with self.lock:
+            items = list(self.values.items()) or [((), 0.0)]
+        for labels, value in items:
+            lines.append(f"{self.name}{format_metric_labels(labels)} {value:g}")
+        return lines
+
+class Histogram:
+    """A Prometheus histogram with fixed buckets."""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = sorted(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+            self.total += value
+            self.count += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for bound, bucket_count in zip(self.buckets, self.counts):
+                lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+            lines.append(f"{self.name}_sum {self.total:g}")
+            lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+def format_metric_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+METRIC_RUNS = Metric("resource_blocker_runs_total", "Test runs finished, by final status.")
+METRIC_TESTS = Metric("resource_blocker_tests_total", "Tests (renders) finished, by status.")
+METRIC_TEST_ERRORS = Metric("resource_blocker_test_errors_total", "Failed tests, by failure class.")
+METRIC_RENDER_DURATION = Histogram("resource_blocker_render_duration_seconds", "Duration of one test from context creation to cleanup.",
+                                   [0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, 120])
+METRIC_SCREENSHOT_BYTES = Histogram("resource_blocker_screenshot_bytes", "Size of saved screenshots.",
+                                    [50e3, 100e3, 250e3, 500e3, 1e6, 2.5e6, 5e6, 10e6])
+METRIC_ROBOTS_CACHE = Metric("resource_blocker_robots_cache_total", "robots.txt cache lookups, by cache (file/verdict) and result (hit/miss).")
+METRIC_INTERCEPTED = Metric("resource_blocker_intercepted_requests_total", "Requests handled by route callbacks, by action.")
+METRIC_CONTEXTS_OPEN = Metric("resource_blocker_browser_contexts_open", "Browser contexts currently open (browser pool occupancy).", "gauge")
+METRIC_CONTEXTS_CAPACITY = Metric("resource_blocker_browser_contexts_capacity", "Maximum concurrent browser contexts per browser.", "gauge")
+METRIC_QUEUE_DEPTH = Metric("resource_blocker_queue_depth", "Tests waiting to be rendered, by queue.", "gauge")
+METRIC_LOOP_LAG = Metric("resource_blocker_event_loop_lag_seconds", "Last measured delay of the Playwright event loop.", "gauge")
+METRIC_LOOP_LAG_MAX = Metric("resource_blocker_event_loop_lag_max_seconds", "Largest event loop delay measured in the current run.", "gauge")
+ALL_METRICS = [METRIC_RUNS, METRIC_TESTS, METRIC_TEST_ERRORS, METRIC_RENDER_DURATION, METRIC_SCREENSHOT_BYTES,
+               METRIC_ROBOTS_CACHE, METRIC_INTERCEPTED, METRIC_CONTEXTS_OPEN, METRIC_CONTEXTS_CAPACITY,
+               METRIC_QUEUE_DEPTH, METRIC_LOOP_LAG, METRIC_LOOP_LAG_MAX]
+
+def observe_test_result(result):
+    """Updates the test metrics from a finished result (local, sharded or distributed)."""
+    METRIC_TESTS.inc(status="error" if result.get('error') else "ok")
+    if result.get('error'):
+        METRIC_TEST_ERRORS.inc(error_class=result.get('error_class') or "other")
+    if result.get('duration_ms') is not None:
+        METRIC_RENDER_DURATION.observe(result['duration_ms'] / 1000)
+    if result.get('screenshot_bytes'):
+        METRIC_SCREENSHOT_BYTES.observe(result['screenshot_bytes'])
+
+async def monitor_event_loop_lag(interval=0.5):
+    """Measures how late the event loop wakes up, which grows when callbacks hog the loop."""
+    loop = asyncio.get_running_loop()
+    METRIC_LOOP_LAG_MAX.set(0)
+    max_lag = 0.0
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        max_lag = max(max_lag, lag)
+        METRIC_LOOP_LAG.set(lag)
+        METRIC_LOOP_LAG_MAX.set(max_lag)
+
 # --- Logging for Flask UI ---
 def log_message(message):
     """Adds a timestamped message to the test log."""
     timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
     print(message) # Also print to console
     test_log.append(f"[{timestamp}] {message}")
+    if shard_events is not None:
+        shard_events.put(("log", test_log[-1]))
 
 # --- Playwright Logic ---
 discovered_resource_paths = set()
+discovered_resource_hashes = {} # Full URL -> sha256 of the body (incremental mode only)
+discovered_resource_meta = {} # Full URL -> {'resource_type', 'host', 'third_party'} (scenarios mode only)
 page_url_parsed = None # Will be set when PAGE_URL is known
 page_url_base_path = None # Will be set when PAGE_URL is known
 
@@ -113,6 +369,14 @@ async def handle_response_for_discovery(response):
         if page_url_base_path and url_base.rstrip('/') == page_url_base_path.rstrip('/'):
             return
 
+        # Keep metadata of every subresource for grouped scenarios
+        if SCENARIOS_MODE and full_url not in discovered_resource_meta:
+            discovered_resource_meta[full_url] = {
+                'resource_type': response.request.resource_type,
+                'host': parsed_url.netloc,
+                'third_party': is_third_party_host(parsed_url.netloc),
+            }
+
         # Vérifier si l'URL complète contient des paramètres de requête
         has_query_params = '?' in full_url
 
@@ -122,38 +386,102 @@ async def handle_response_for_discovery(response):
                  content_type = await response.header_value("content-type") or "N/A"
                  log_message(f"  [Discovery] Resource with parameters found: {full_url} (Type: {content_type.split(';')[0]})")
                  discovered_resource_paths.add(full_url) # Ajoute l'URL complète
+                 if INCREMENTAL_MODE:
+                     discovered_resource_hashes[full_url] = await hash_response_body(response)
 
         # Note: Resources without query parameters are now ignored in discovery mode
 
     except Exception as e:
         log_message(f"  Warning: Could not parse response for {full_url}: {e}")
 
+async def hash_response_body(response):
+    """Returns the sha256 of a response body, or None if it is not available (e.g. redirects)."""
+    try:
+        return hashlib.sha256(await response.body()).hexdigest()
+    except Exception:
+        return None
 
-async def block_request_handler(route, request, blocked_reason="resource"):
-    """Callback to block a request."""
+async def block_request_handler(route, request, blocked_reason="resource", record_timing=True):
+    """Callback to block a request.
+       record_timing is False when called from a route handler that times its whole body itself.
+    """
+    callback_start = time.perf_counter()
     # Log the exact URL, type, and frame URL being blocked
     resource_type = request.resource_type
     frame_url = request.frame.url
     log_message(f"  >> Blocking Request (Reason: {blocked_reason}, Type: {resource_type}, Frame: {frame_url}): {request.url}")
     # Optional log (kept commented)
     # log_message(f"  >> Blocking ({blocked_reason[:20]}...): {request.url[:80]}...")
+    METRIC_INTERCEPTED.inc(action="blocked")
+    from playwright.async_api import Error as PlaywrightError # Already loaded once a page exists
     try:
         await route.abort()
     except PlaywrightError as e:
         # Ignore errors caused by the page/context closing during abort
         if "Target page, context or browser has been closed" not in str(e) and "Request context is destroyed" not in str(e):
             log_message(f"  Warning: Error during abort (might be normal): {e}")
+    if record_timing:
+        record_phase("route_callback", time.perf_counter() - callback_start)
 
 class RobotsChecker:
     """Classe pour gérer la vérification des robots.txt avec le parser officiel de Google."""
     
     def __init__(self):
+        from gpyrobotstxt.robots_cc import RobotsMatcher
         self.matcher = RobotsMatcher()
         self.robots_cache = {}  # Cache des contenus robots.txt par domaine
         self.results = defaultdict(dict)  # Résultats des vérifications par domaine et chemin
-        
-    def check_url_allowed(self, url, user_agent="Googlebot"):
-        """Check if a URL is allowed for a given user-agent."""
+        self.pending_fetches = {}  # domain -> Task fetching its robots.txt in a thread
+
+    def _fetch_robots(self, domain, scheme):
+        """Downloads robots.txt for a domain into the cache (blocking, see ensure_robots_loaded)."""
+        robots_txt_url = f"{scheme}://{domain}/robots.txt"
+        try:
+            fetch_start = time.perf_counter()
+            import requests
+            response = requests.get(robots_txt_url, timeout=10)
+            record_phase("robots_fetch", time.perf_counter() - fetch_start)
+            if response.status_code == 200:
+                self.robots_cache[domain] = response.content
+            else:
+                log_message(f"  No robots.txt found for {domain} (status: {response.status_code})")
+                self.robots_cache[domain] = b""  # Empty cache if no robots.txt
+        except Exception as e:
+            log_message(f"  Error loading robots.txt for {domain}: {e}")
+            self.robots_cache[domain] = b""  # Empty cache in case of error
+
+    async def ensure_robots_loaded(self, url):
+        """Fetches robots.txt for the URL's domain in a thread if it is not cached yet, so route
+           callbacks on the shared event loop never block on the network. Concurrent callers
+           for the same domain wait for the same fetch.
+        """
+        parsed_url = urlparse(url)
+        domain = parsed_url.netloc
+        if not domain:
+            return
+        METRIC_ROBOTS_CACHE.inc(cache="file", result="hit" if domain in self.robots_cache else "miss")
+        if domain in self.robots_cache:
+            return
+        task = self.pending_fetches.get(domain)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(asyncio.to_thread(self._fetch_robots, domain, parsed_url.scheme or "https"))
+            self.pending_fetches[domain] = task
+        try:
+            await asyncio.shield(task)
+        finally:
+            if task.done() and self.pending_fetches.get(domain) is task:
+                del self.pending_fetches[domain]
+
+    async def check_url_allowed_async(self, url, user_agent="Googlebot"):
+        """check_url_allowed for coroutines: the robots.txt download happens off the event loop."""
+        await self.ensure_robots_loaded(url) # Counts the robots.txt cache hit or miss
+        return self.check_url_allowed(url, user_agent, count_file_cache=False)
+
+    def check_url_allowed(self, url, user_agent="Googlebot", count_file_cache=True):
+        """Check if a URL is allowed for a given user-agent.
+           count_file_cache is False when ensure_robots_loaded already counted the robots.txt lookup.
+        """
+        check_start = time.perf_counter()
         try:
             parsed_url = urlparse(url)
             if not parsed_url.netloc:
@@ -166,17 +494,11 @@ class RobotsChecker:
             robots_txt_url = f"{scheme}://{domain}/robots.txt"
             
             # Check if we already have robots.txt content in cache
+            if count_file_cache:
+                METRIC_ROBOTS_CACHE.inc(cache="file", result="hit" if domain in self.robots_cache else "miss")
             if domain not in self.robots_cache:
-                try:
-                    response = requests.get(robots_txt_url, timeout=10)
-                    if response.status_code == 200:
-                        self.robots_cache[domain] = response.content
-                    else:
-                        log_message(f"  No robots.txt found for {domain} (status: {response.status_code})")
-                        self.robots_cache[domain] = b""  # Empty cache if no robots.txt
-                except Exception as e:
-                    log_message(f"  Error loading robots.txt for {domain}: {e}")
-                    self.robots_cache[domain] = b""  # Empty cache in case of error
+                # Coroutines call ensure_robots_loaded first, so this only blocks synchronous callers
+                self._fetch_robots(domain, scheme)
             
             # Get full path with query string
             path_with_query = parsed_url.path
@@ -185,7 +507,9 @@ class RobotsChecker:
             
             # Check if we already have the result in cache
             if path_with_query in self.results[domain]:
+                METRIC_ROBOTS_CACHE.inc(cache="verdict", result="hit")
                 return self.results[domain][path_with_query]
+            METRIC_ROBOTS_CACHE.inc(cache="verdict", result="miss")
             
             # Check authorization with Google parser
             is_allowed = self.matcher.allowed_by_robots(
@@ -203,19 +527,247 @@ class RobotsChecker:
         except Exception as e:
             log_message(f"  Error checking robots.txt for {url}: {e}")
             return True
+        finally:
+            record_phase("robots_check", time.perf_counter() - check_start)
 
 # Créer une instance globale du RobotsChecker
-robots_checker = RobotsChecker()
+robots_checker = None # Created by get_robots_checker() on first use
+
+def get_robots_checker():
+    """Returns the process-wide RobotsChecker, creating it on first use."""
+    global robots_checker
+    if robots_checker is None:
+        robots_checker = RobotsChecker()
+    return robots_checker
+
+# --- Failure Classification ---
+TRANSIENT_ERROR_CLASSES = {"timeout", "crash", "connection"} # Worth retrying
+ORIGIN_ERROR_CLASSES = {"dns", "tls", "connection"} # Suggest the origin itself is unreachable
+
+ERROR_CLASS_MARKERS = [
+    ("dns", ["ERR_NAME_NOT_RESOLVED", "ERR_NAME_RESOLUTION_FAILED"]),
+    ("tls", ["ERR_CERT_", "ERR_SSL_", "ERR_BAD_SSL_CLIENT_AUTH_CERT"]),
+    ("crash", ["Target crashed", "Page crashed", "Browser has been closed", "browser has disconnected"]),
+    ("aborted", ["ERR_ABORTED", "ERR_BLOCKED_BY_CLIENT"]),
+    ("connection", ["ERR_CONNECTION_", "ERR_EMPTY_RESPONSE", "ERR_ADDRESS_UNREACHABLE",
+                    "ERR_INTERNET_DISCONNECTED", "ERR_NETWORK_CHANGED", "ERR_TIMED_OUT"]),
+]
+
+def classify_error(error):
+    """Maps a navigation/screenshot exception to a failure class:
+       timeout, dns, tls, crash, aborted (main document aborted), connection or other.
+    """
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+    if isinstance(error, PlaywrightTimeoutError):
+        return "timeout"
+    message = str(error)
+    for error_class, markers in ERROR_CLASS_MARKERS:
+        if any(marker in message for marker in markers):
+            return error_class
+    if "Timeout" in message and "exceeded" in message:
+        return "timeout"
+    return "other"
+
+class CircuitBreaker:
+    """Stops a run early when the origin looks down, instead of letting every test time out."""
+
+    def __init__(self, threshold=CIRCUIT_BREAKER_THRESHOLD):
+        self.threshold = threshold
+        self.consecutive_failures = 0
+        self.is_open = False
+        self.reason = None
+
+    def record_success(self):
+        self.consecutive_failures = 0
+
+    def record_failure(self, error_class, message):
+        if error_class not in ORIGIN_ERROR_CLASSES:
+            return
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.threshold:
+            self.trip(f"{self.consecutive_failures} consecutive '{error_class}' failures, last: {message}")
+
+    def trip(self, reason):
+        if not self.is_open:
+            self.is_open = True
+            self.reason = reason
+            log_message(f"  CIRCUIT BREAKER OPEN: {reason}. Remaining tests are skipped.")
+            if shard_events is not None:
+                shard_events.put(("circuit_open", reason))
+
+circuit_breaker = CircuitBreaker() # Reset at the start of each run
+
+# --- Blocking Scenarios ---
+# Second-level labels registered under country-code TLDs (example.co.uk, example.com.au...),
+# used when tldextract is not installed
+COUNTRY_SECOND_LEVEL_LABELS = {"co", "com", "net", "org", "gov", "edu", "ac", "ne", "or", "go", "gob", "gouv", "nic", "mil", "ltd", "plc", "sch", "nhs"}
+tld_extractor = None # tldextract.TLDExtract when installed (offline, bundled public suffix list)
+
+@lru_cache(maxsize=4096)
+def registrable_domain(host):
+    """Returns the site a host belongs to (example.co.uk for www.example.co.uk). Uses the public
+       suffix list through tldextract when installed, otherwise handles the common two-level suffixes.
+    """
+    global tld_extractor
+    host = host.lower().rstrip(".")
+    try:
+        ipaddress.ip_address(host)
+        return host # IP addresses are their own site
+    except ValueError:
+        pass
+    try:
+        import tldextract
+    except ImportError:
+        tldextract = None
+    if tldextract:
+        if tld_extractor is None:
+            tld_extractor = tldextract.TLDExtract(suffix_list_urls=()) # Never download the list at runtime
+        extracted = tld_extractor(host)
+        if extracted.domain and extracted.suffix:
+            return f"{extracted.domain}.{extracted.suffix}"
+        return host
+    labels = host.split(".")
+    if len(labels) >= 3 and len(labels[-1]) == 2 and labels[-2] in COUNTRY_SECOND_LEVEL_LABELS:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+def is_third_party_host(host):
+    """True if host belongs to another site (registrable domain) than the tested page."""
+    if not page_url_parsed or not host:
+        return False
+    page_host = page_url_parsed.hostname or ""
+    host = host.split(':')[0]
+    return host != page_host and registrable_domain(host) != registrable_domain(page_host)
 
-async def run_single_test(browser, url_to_block, file_prefix, reason_suffix, is_combined_block=False, block_list_for_all=None, is_googlebot_view=False):
-    """Runs a single Playwright test case (reference or blocking one/all resources)."""
+def build_scenarios():
+    """Derives grouped blocking scenarios from the discovery metadata, most populated first:
+       all third-party, one per resource type, one per host x type, and the robots.txt view except CSS.
+    """
+    by_type = defaultdict(int)
+    by_host_type = defaultdict(int)
+    third_party_count = 0
+    for meta in discovered_resource_meta.values():
+        if meta['resource_type'] not in SCENARIO_RESOURCE_TYPES:
+            continue
+        by_type[meta['resource_type']] += 1
+        by_host_type[(meta['host'], meta['resource_type'])] += 1
+        third_party_count += meta['third_party']
+
+    scenarios = [{'id': 'robots_except_css', 'label': 'Everything robots.txt disallows except CSS',
+                  'robots_disallowed': True, 'except_types': ['stylesheet']}]
+    if third_party_count:
+        scenarios.append({'id': 'third_party', 'label': f'All third-party resources ({third_party_count})', 'third_party': True})
+    for resource_type, count in sorted(by_type.items(), key=lambda item: -item[1]):
+        scenarios.append({'id': f'type_{resource_type}', 'label': f'All {resource_type} resources ({count})', 'resource_type': resource_type})
+    for (host, resource_type), count in sorted(by_host_type.items(), key=lambda item: -item[1]):
+        scenarios.append({'id': f'host_{host}_{resource_type}', 'label': f'{resource_type} from {host} ({count})',
+                          'host': host, 'resource_type': resource_type, 'resource_count': count})
+    return scenarios[:MAX_SCENARIOS]
+
+def scenario_blocks(scenario, url, resource_type):
+    """True if a request (URL and Playwright resource type) is blocked by the scenario."""
+    host = urlparse(url).netloc
+    if scenario.get('host') and host != scenario['host']:
+        return False
+    if scenario.get('resource_type') and resource_type != scenario['resource_type']:
+        return False
+    if scenario.get('third_party') and not is_third_party_host(host):
+        return False
+    if scenario.get('robots_disallowed'):
+        if resource_type in scenario.get('except_types', []) or resource_type == "document":
+            return False
+        return not get_robots_checker().check_url_allowed(url)
+    return True
+
+def build_impact_matrix(results=None, device=None):
+    """Rolls host x type scenario results of one device (the first of DEVICE_MATRIX by default)
+       up into a matrix, plus the aggregate scenarios.
+    """
+    device = device or DEVICE_MATRIX[0]
+    hosts, types, cells, aggregates = [], [], defaultdict(dict), []
+    for result in (test_results if results is None else results):
+        scenario = result.get('scenario')
+        if not scenario or result.get('device', "default") != device:
+            continue
+        entry = {'prefix': result['prefix'], 'impact_score': result.get('impact_score'), 'error': result['error'],
+                 'screenshot_file': result['screenshot_file'], 'label': scenario['label']}
+        if scenario.get('host'):
+            if scenario['host'] not in hosts:
+                hosts.append(scenario['host'])
+            if scenario['resource_type'] not in types:
+                types.append(scenario['resource_type'])
+            cells[scenario['host']][scenario['resource_type']] = dict(entry, resource_count=scenario.get('resource_count'))
+        else:
+            aggregates.append(dict(entry, id=scenario['id']))
+    return {'device': device, 'hosts': hosts, 'types': sorted(types, key=SCENARIO_RESOURCE_TYPES.index), 'cells': cells, 'aggregates': aggregates}
+
+# --- Device Matrix ---
+def extra_viewport_widths(device):
+    """Extra widths worth capturing from a page loaded with this device: only widths of the same class
+       (mobile or desktop), since the user agent and touch support cannot change without a reload.
+    """
+    is_mobile = DEVICES[device]["user_agent"] == GOOGLEBOT_SMARTPHONE_UA
+    return [w for w in VIEWPORT_WIDTHS if (w <= MOBILE_MAX_WIDTH) == is_mobile]
+
+async def capture_extra_viewports(page, device, screenshot_filename, result_data):
+    """Resizes the already loaded page to each extra width and takes a screenshot, without reloading."""
+    original_viewport = page.viewport_size
+    height = (original_viewport or {}).get("height", 720)
+    for width in extra_viewport_widths(device):
+        viewport_filename = f"{os.path.splitext(screenshot_filename)[0]}_{width}w.png"
+        try:
+            await page.set_viewport_size({"width": width, "height": height})
+            await page.wait_for_timeout(VIEWPORT_SETTLE_MS)
+            await page.screenshot(path=os.path.join(OUTPUT_DIR, viewport_filename), full_page=True, timeout=SCREENSHOT_TIMEOUT_MS)
+            result_data['viewport_screenshots'].append({'width': width, 'screenshot_file': viewport_filename})
+            log_message(f"  Viewport screenshot saved ({width}px): {viewport_filename}")
+        except Exception as e:
+            log_message(f"  Warning: Could not capture the {width}px viewport: {e}")
+
+# --- Impact Score ---
+RENDER_METRICS_SCRIPT = """() => ({
+    height: document.documentElement.scrollHeight,
+    text_length: document.body ? document.body.innerText.length : 0,
+    elements: document.getElementsByTagName('*').length,
+    images_loaded: Array.from(document.images).filter(img => img.complete && img.naturalWidth > 0).length
+})"""
+
+def compute_impact_scores():
+    """Scores each result from 0 (renders like the reference) to 1 (nothing in common),
+       as the mean relative change of its render metrics against the reference render of the same device.
+    """
+    references = {r.get('device', "default"): r for r in test_results
+                  if r['blocked_item'] == "None (Reference)" and r.get('render_metrics')}
+    for result in test_results:
+        reference = references.get(result.get('device', "default"))
+        metrics = result.get('render_metrics')
+        if not reference or not metrics:
+            result['impact_score'] = None
+            continue
+        changes = [min(1.0, abs(metrics[key] - value) / max(value, 1)) for key, value in reference['render_metrics'].items()]
+        result['impact_score'] = round(sum(changes) / len(changes), 3)
+
+def screenshot_stem(file_prefix, name_for_file, reason_suffix, device="default"):
+    """Filename of a test's screenshots without extension; error and viewport screenshots add a suffix to it."""
+    filename_base = sanitize_filename(name_for_file)
+    if device != "default":
+        filename_base = f"{filename_base}_{device}"
+    return f"{file_prefix}_{filename_base}{reason_suffix}"
+
+async def run_single_test(browser, url_to_block, file_prefix, reason_suffix, is_combined_block=False, block_list_for_all=None, is_googlebot_view=False, scenario=None, device="default"):
+    """Runs a single Playwright test case (reference, blocking one/all resources, or a grouped scenario)
+       with one device configuration, plus screenshots at the extra VIEWPORT_WIDTHS of its class.
+    """
     global test_results
 
-    is_reference = url_to_block is None and not is_googlebot_view
+    is_reference = url_to_block is None and not is_googlebot_view and scenario is None
     name_for_file = url_to_block or "reference"
     current_blocked_item = "None (Reference)"
     
-    if is_googlebot_view:
+    if scenario:
+        name_for_file = f"scenario_{scenario['id']}"
+        current_blocked_item = f"SCENARIO: {scenario['label']}"
+    elif is_googlebot_view:
         name_for_file = "googlebot_view"
         current_blocked_item = "GOOGLEBOT_VIEW"
     elif is_combined_block:
@@ -225,16 +777,24 @@ async def run_single_test(browser, url_to_block, file_prefix, reason_suffix, is_
         current_blocked_item = url_to_block
 
     # Generate filenames
-    filename_base = sanitize_filename(name_for_file)
-    screenshot_filename = f"{file_prefix}_{filename_base}{reason_suffix}.png"
+    file_stem = screenshot_stem(file_prefix, name_for_file, reason_suffix, device)
+    screenshot_filename = f"{file_stem}.png"
     screenshot_path = os.path.join(OUTPUT_DIR, screenshot_filename)
-    error_screenshot_filename = f"{file_prefix}_{filename_base}{reason_suffix}_ERROR.png"
+    error_screenshot_filename = f"{file_stem}_ERROR.png"
     error_screenshot_path = os.path.join(OUTPUT_DIR, error_screenshot_filename)
 
+    test_start = time.perf_counter()
+    timings = [] # Per-test waterfall of timing spans
+    device_label = "" if device == "default" else f" [{device}]"
     if is_googlebot_view:
-        log_message(f"\n--- Test {file_prefix}: Googlebot View ---")
+        log_message(f"\n--- Test {file_prefix}{device_label}: Googlebot View ---")
     else:
-        log_message(f"\n--- Test {file_prefix}: Blocking '{current_blocked_item}' ---")
+        log_message(f"\n--- Test {file_prefix}{device_label}: Blocking '{current_blocked_item}' ---")
+
+    googlebot_allowed = True if is_reference else None
+    if url_to_block and not is_reference:
+        with timing_span(timings, "robots_verdict", test_start):
+            googlebot_allowed = await get_robots_checker().check_url_allowed_async(url_to_block)
 
     # Data structure to store results for this test
     result_data = {
@@ -246,28 +806,67 @@ async def run_single_test(browser, url_to_block, file_prefix, reason_suffix, is_
         'suffix': reason_suffix,
         'blocked_item': current_blocked_item,
         'is_googlebot_view': is_googlebot_view,
-        'googlebot_allowed': True if is_reference else (robots_checker.check_url_allowed(url_to_block) if url_to_block else None)
+        'googlebot_allowed': googlebot_allowed,
+        'error_class': None,
+        'attempts': 0,
+        'timings': timings,
+        'scenario': scenario,
+        'render_metrics': None,
+        'device': device,
+        'viewport_screenshots': []
     }
 
+    if circuit_breaker.is_open:
+        # The origin looks down: record the test as skipped without rendering
+        log_message(f"  Skipped: circuit breaker open ({circuit_breaker.reason})")
+        result_data['error'] = True
+        result_data['error_class'] = "circuit_open"
+        result_data['error_message'] = f"Skipped, origin unreachable: {circuit_breaker.reason}"
+        result_data['screenshot_file'] = None
+        observe_test_result(result_data)
+        record_result(result_data)
+        return
+
     context = None
     page = None
     try:
         # Create a new browser context with a specific user agent
-        context = await browser.new_context(
-            user_agent="Mozilla/5.0 (Linux; Android 6.0.1; Nexus 5X Build/MMB29P) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/W.X.Y.Z Mobile Safari/537.36 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"
-        )
+        with timing_span(timings, "context_create", test_start):
+            context = await browser.new_context(**DEVICES[device])
+        METRIC_CONTEXTS_OPEN.inc()
 
         # Set up request blocking if not the reference run
         if not is_reference:
-            if is_googlebot_view:
+            if scenario:
+                # Grouped scenario: match on host, resource type, party or robots.txt verdict
+                async def scenario_block_handler(route, request):
+                    callback_start = time.perf_counter()
+                    try:
+                        if scenario.get('robots_disallowed'):
+                            await get_robots_checker().ensure_robots_loaded(request.url)
+                        if scenario_blocks(scenario, request.url, request.resource_type):
+                            await block_request_handler(route, request, f"Scenario {scenario['id']}", record_timing=False)
+                        else:
+                            await route.continue_()
+                    finally:
+                        record_phase("route_callback", time.perf_counter() - callback_start)
+
+                await context.route("**/*", scenario_block_handler)
+                log_message(f"  Blocking rule enabled for scenario: {scenario['label']}")
+            elif is_googlebot_view:
                 # Pour la vue Googlebot, on bloque toute ressource non autorisée par robots.txt
                 async def googlebot_block_handler(route, request):
-                    url = request.url
-                    is_allowed = robots_checker.check_url_allowed(url)
-                    if not is_allowed:
-                        await block_request_handler(route, request, f"Blocked by robots.txt: {url[:50]}...")
-                    else:
-                        await route.continue_()
+                    callback_start = time.perf_counter() # Includes waiting for the robots.txt verdict
+                    try:
+                        url = request.url
+                        is_allowed = await get_robots_checker().check_url_allowed_async(url)
+                        if not is_allowed:
+                            await block_request_handler(route, request, f"Blocked by robots.txt: {url[:50]}...", record_timing=False)
+                        else:
+                            METRIC_INTERCEPTED.inc(action="continued")
+                            await route.continue_()
+                    finally:
+                        record_phase("route_callback", time.perf_counter() - callback_start)
                 
                 # Route ALL requests through our handler
                 await context.route("**/*", googlebot_block_handler)
@@ -321,55 +920,682 @@ async def run_single_test(browser, url_to_block, file_prefix, reason_suffix, is_
                 )
                 log_message(f"  Blocking rule enabled for: {url_to_block}")
 
-        # Create a new page in the context
-        page = await context.new_page()
+        attempts = 0
+        while True:
+            attempts += 1
+            result_data['attempts'] = attempts
+            # Create a new page in the context
+            with timing_span(timings, "page_create", test_start):
+                page = await context.new_page()
 
-        try:
-            # Navigate to the target page
-            log_message(f"  Navigating to {PAGE_URL}...")
-            # Wait until the network is idle (or timeout)
-            await page.goto(PAGE_URL, wait_until="networkidle", timeout=90000) # Augmentation du timeout de goto à 90s
-            log_message(f"  Page loaded ('networkidle'). Waiting briefly before screenshot...") # Log avant attente
-            # >> Délai réduit <<
-            await page.wait_for_timeout(2000) # Attendre 2 secondes (réduction)
-            log_message(f"  Taking screenshot...")
-            # Take a full-page screenshot with increased timeout
-            await page.screenshot(path=screenshot_path, full_page=True, timeout=90000)
-            log_message(f"  Screenshot saved: {screenshot_path}")
-
-        except Exception as e_nav:
-            # Handle navigation/screenshot errors
-            log_message(f"  ERROR during navigation/screenshot for {name_for_file}: {e_nav}")
-            result_data['error'] = True
-            result_data['error_message'] = str(e_nav)
-            result_data['screenshot_file'] = error_screenshot_filename # Use error filename
             try:
-                # Try taking an error screenshot anyway, also with timeout
-                if page and not page.is_closed():
-                    await page.screenshot(path=error_screenshot_path, full_page=True, timeout=90000)
-                    log_message(f"  Error screenshot saved: {error_screenshot_path}")
-            except Exception as e_shot:
-                log_message(f"  Could not take screenshot even after error: {e_shot}")
+                # Navigate to the target page
+                log_message(f"  Navigating to {PAGE_URL}...")
+                # Wait until the network is idle (or timeout)
+                with timing_span(timings, "navigation", test_start):
+                    await page.goto(PAGE_URL, wait_until="networkidle", timeout=GOTO_TIMEOUT_MS)
+                log_message(f"  Page loaded ('networkidle'). Waiting briefly before screenshot...") # Log avant attente
+                with timing_span(timings, "settle_wait", test_start):
+                    await page.wait_for_timeout(SETTLE_DELAY_MS)
+                with timing_span(timings, "render_metrics", test_start):
+                    try:
+                        result_data['render_metrics'] = await page.evaluate(RENDER_METRICS_SCRIPT)
+                    except Exception as e_metrics:
+                        log_message(f"  Warning: Could not read render metrics: {e_metrics}")
+                log_message(f"  Taking screenshot...")
+                # Take a full-page screenshot
+                with timing_span(timings, "screenshot", test_start):
+                    await page.screenshot(path=screenshot_path, full_page=True, timeout=SCREENSHOT_TIMEOUT_MS)
+                log_message(f"  Screenshot saved: {screenshot_path}")
+                result_data['screenshot_bytes'] = os.path.getsize(screenshot_path)
+                circuit_breaker.record_success()
+                if extra_viewport_widths(device):
+                    with timing_span(timings, "viewport_screenshots", test_start):
+                        await capture_extra_viewports(page, device, screenshot_filename, result_data)
+                break
+
+            except Exception as e_nav:
+                error_class = classify_error(e_nav)
+                if error_class in TRANSIENT_ERROR_CLASSES and attempts <= NAV_MAX_RETRIES and not circuit_breaker.is_open:
+                    delay = NAV_RETRY_BACKOFF * 2 ** (attempts - 1)
+                    log_message(f"  Transient '{error_class}' error for {name_for_file} (attempt {attempts}), retrying in {delay:.1f}s: {e_nav}")
+                    if not page.is_closed():
+                        await page.close()
+                    page = None
+                    with timing_span(timings, "retry_backoff", test_start):
+                        await asyncio.sleep(delay)
+                    continue
+
+                # Handle navigation/screenshot errors
+                log_message(f"  ERROR ({error_class}) during navigation/screenshot for {name_for_file}: {e_nav}")
+                circuit_breaker.record_failure(error_class, e_nav)
+                result_data['error'] = True
+                result_data['error_class'] = error_class
+                result_data['error_message'] = str(e_nav)
+                result_data['screenshot_file'] = error_screenshot_filename # Use error filename
+                try:
+                    # Try taking an error screenshot anyway, with a short deadline
+                    if page and not page.is_closed():
+                        with timing_span(timings, "error_screenshot", test_start):
+                            await page.screenshot(path=error_screenshot_path, full_page=True, timeout=ERROR_SCREENSHOT_TIMEOUT_MS)
+                        log_message(f"  Error screenshot saved: {error_screenshot_path}")
+                except Exception as e_shot:
+                    log_message(f"  Could not take screenshot even after error: {e_shot}")
+                break
 
     except Exception as e_ctx:
         # Handle errors during context creation/management
         log_message(f"  ERROR during context creation/management for {name_for_file}: {e_ctx}")
         result_data['error'] = True
+        result_data['error_class'] = classify_error(e_ctx)
         result_data['error_message'] = f"Context error: {e_ctx}"
         result_data['screenshot_file'] = error_screenshot_filename # Use error filename
     finally:
         # Ensure page and context are closed
-        if page and not page.is_closed():
-            await page.close()
-        if context:
+        with timing_span(timings, "cleanup", test_start):
+            if page and not page.is_closed():
+                await page.close()
+            if context:
+                METRIC_CONTEXTS_OPEN.inc(-1)
+                try:
+                    await context.close()
+                except Exception: pass # Ignore errors during close
+        result_data['duration_ms'] = round((time.perf_counter() - test_start) * 1000, 1)
+        observe_test_result(result_data)
+        record_result(result_data) # Add result to the global list and the export journal
+
+async def run_test_batches(browser, test_specs):
+    """Runs tests in batches of CONCURRENCY on the given browser.
+       Each spec is a dict of keyword arguments for run_single_test.
+    """
+    METRIC_CONTEXTS_CAPACITY.set(CONCURRENCY)
+    for i in range(0, len(test_specs), CONCURRENCY):
+        batch = test_specs[i:i + CONCURRENCY]
+        METRIC_QUEUE_DEPTH.set(len(test_specs) - i, queue="local")
+        if circuit_breaker.is_open:
+            log_message(f"  Batch {i // CONCURRENCY + 1} skipped (circuit breaker open).")
+        else:
+            log_message(f"  Running batch {i // CONCURRENCY + 1} ({len(batch)} tests)...")
+        # Tests are only created per batch so an open circuit breaker short-circuits the rest
+        await asyncio.gather(*(run_single_test(browser, **spec) for spec in batch))
+        log_message(f"  Batch {i // CONCURRENCY + 1} finished.")
+    METRIC_QUEUE_DEPTH.set(0, queue="local")
+
+def for_each_device(specs):
+    """Expands test specs into one spec per device of DEVICE_MATRIX."""
+    return [dict(spec, device=device) for spec in specs for device in DEVICE_MATRIX]
+
+async def run_individual_tests(browser, indexed_urls, reason):
+    """Runs individual blocking tests in batches on the given browser, once per device.
+       indexed_urls is a list of (index, url) pairs so prefixes stay stable across shards.
+    """
+    await run_test_batches(browser, for_each_device([
+        {'url_to_block': url_to_block, 'file_prefix': f"{i+1:02d}", 'reason_suffix': reason}
+        for i, url_to_block in indexed_urls
+    ]))
+
+async def _run_test_shard_async(indexed_urls, reason):
+    """Launches a dedicated Playwright browser and runs one shard of tests on it."""
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        try:
+            await run_individual_tests(browser, indexed_urls, reason)
+        finally:
+            await browser.close()
+
+def run_test_shard(page_url, discover_mode, indexed_urls, reason, robots_cache, profile_enabled=False, devices=None, viewport_widths=None,
+                   concurrency=None, output_dir=None, events=None):
+    """Entry point of a worker process: renders one shard of the individual tests.
+       Settings are passed explicitly since spawned processes re-import the module with its defaults.
+       Results, log lines and breaker trips are streamed to the parent through events as they happen;
+       the shard's hot-path stats are returned at the end.
+    """
+    global PAGE_URL, DISCOVER_MODE, PROFILE_ENABLED, DEVICE_MATRIX, VIEWPORT_WIDTHS, CONCURRENCY, OUTPUT_DIR, test_results, test_log, results_journal_enabled, shard_events
+    results_journal_enabled = False # The parent records the streamed results
+    shard_events = events
+    CONCURRENCY = concurrency or CONCURRENCY
+    OUTPUT_DIR = output_dir or OUTPUT_DIR
+    PAGE_URL = page_url
+    DISCOVER_MODE = discover_mode
+    PROFILE_ENABLED = profile_enabled
+    DEVICE_MATRIX = devices or ["default"]
+    VIEWPORT_WIDTHS = viewport_widths or []
+    test_results = []
+    test_log = []
+    # Reuse robots.txt files already fetched by the parent
+    get_robots_checker().robots_cache.update(robots_cache)
+    with profiling("shard"):
+        asyncio.run(_run_test_shard_async(indexed_urls, reason))
+    return dict(phase_stats)
+
+async def merge_shard_events(events):
+    """Records the results, log lines and breaker trips streamed by shard processes until a None sentinel."""
+    while True:
+        event = await asyncio.to_thread(events.get)
+        if event is None:
+            return
+        kind, value = event
+        if kind == "result":
+            observe_test_result(value)
+            record_result(value)
+        elif kind == "log":
+            test_log.append(value)
+        elif kind == "circuit_open":
+            circuit_breaker.trip(f"in a worker process: {value}")
+
+async def run_sharded_tests(indexed_urls, reason):
+    """Shards the individual tests across WORKERS processes, each with its own browser,
+       and merges their results and logs into the current run as they complete.
+    """
+    shards = [indexed_urls[w::WORKERS] for w in range(WORKERS)]
+    shards = [shard for shard in shards if shard]
+    log_message(f"\n--- Starting {len(indexed_urls)} individual blocking tests across {len(shards)} worker processes (Concurrency per worker: {CONCURRENCY}) ---")
+
+    loop = asyncio.get_running_loop()
+    # 'spawn' avoids forking the Flask/Playwright threads of the parent
+    mp_context = multiprocessing.get_context("spawn")
+    with mp_context.Manager() as manager, ProcessPoolExecutor(max_workers=len(shards), mp_context=mp_context) as executor:
+        events = manager.Queue()
+        merger = asyncio.create_task(merge_shard_events(events))
+        try:
+            futures = [
+                loop.run_in_executor(executor, run_test_shard, PAGE_URL, DISCOVER_MODE, shard, reason, dict(get_robots_checker().robots_cache),
+                                     PROFILE_ENABLED, DEVICE_MATRIX, VIEWPORT_WIDTHS, CONCURRENCY, OUTPUT_DIR, events)
+                for shard in shards
+            ]
+            for done, future in enumerate(asyncio.as_completed(futures), 1):
+                try:
+                    shard_phase_stats = await future
+                except Exception as e:
+                    log_message(f"  ERROR in worker process: {e}")
+                    continue
+                for phase, (count, total, longest) in shard_phase_stats.items():
+                    stats = phase_stats[phase]
+                    stats[0] += count
+                    stats[1] += total
+                    stats[2] = max(stats[2], longest)
+                log_message(f"  Worker shard {done}/{len(shards)} finished.")
+        finally:
+            # Shards put their events before returning, so the sentinel comes after all of them
+            events.put(None)
+            await merger
+
+# --- Distributed Work Queue ---
+class WorkQueue:
+    """SQLite-backed job queue used by the coordinator to hand individual tests to remote workers.
+
+    Jobs are leased to a worker on claim and kept alive by heartbeats. Jobs whose lease
+    expires are requeued until QUEUE_MAX_ATTEMPTS is reached. Result writes are idempotent:
+    only the worker holding the lease can complete a job, once; later uploads are rejected.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                run_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending', -- pending, running, done, failed
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker_id TEXT,
+                heartbeat_at REAL,
+                result TEXT,
+                updated_at REAL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, run_id)")
+
+    def enqueue(self, run_id, payloads):
+        """Adds one job per payload. Payloads are keyed by their 'prefix' and 'device' within the run."""
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO jobs (job_id, run_id, payload, updated_at) VALUES (?, ?, ?, ?)",
+                [(f"{run_id}:{payload['prefix']}:{payload['device']}", run_id, json.dumps(payload), now) for payload in payloads]
+            )
+
+    def _requeue_expired(self, now):
+        expired_before = now - QUEUE_LEASE_SECONDS
+        self.conn.execute(
+            "UPDATE jobs SET status = 'failed', result = ?, updated_at = ? "
+            "WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?",
+            (json.dumps({'error_message': 'Worker lease expired too many times'}), now, expired_before, QUEUE_MAX_ATTEMPTS)
+        )
+        self.conn.execute(
+            "UPDATE jobs SET status = 'pending', worker_id = NULL, updated_at = ? "
+            "WHERE status = 'running' AND heartbeat_at < ?",
+            (now, expired_before)
+        )
+
+    def claim(self, worker_id):
+        """Leases the oldest pending job to worker_id. Returns the job dict or None."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._requeue_expired(now)
+                row = self.conn.execute(
+                    "SELECT job_id, payload, attempts FROM jobs WHERE status = 'pending' ORDER BY rowid LIMIT 1"
+                ).fetchone()
+                if row:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'running', worker_id = ?, heartbeat_at = ?, attempts = attempts + 1, updated_at = ? WHERE job_id = ?",
+                        (worker_id, now, now, row['job_id'])
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        if not row:
+            return None
+        return {'job_id': row['job_id'], 'attempt': row['attempts'] + 1, 'payload': json.loads(row['payload'])}
+
+    def heartbeat(self, job_id, worker_id):
+        """Extends the lease of a running job. Returns False if the worker lost the lease."""
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE job_id = ? AND worker_id = ? AND status = 'running'",
+                (time.time(), job_id, worker_id)
+            )
+        return cursor.rowcount == 1
+
+    def leased_payload(self, job_id, worker_id):
+        """Returns the payload of a job currently leased to worker_id, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT payload FROM jobs WHERE job_id = ? AND worker_id = ? AND status = 'running'",
+                (job_id, worker_id)
+            ).fetchone()
+        return json.loads(row['payload']) if row else None
+
+    def complete(self, job_id, worker_id, result, on_recorded=None):
+        """Records the result of a job still leased to worker_id. Returns False if the job is unknown,
+           already finished or leased to another worker. on_recorded (e.g. moving the uploaded
+           screenshots into place) runs in the same transaction, only when the result is recorded.
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
             try:
-                await context.close()
-            except Exception: pass # Ignore errors during close
-        test_results.append(result_data) # Add result to the global list
+                cursor = self.conn.execute(
+                    "UPDATE jobs SET status = 'done', result = ?, updated_at = ? WHERE job_id = ? AND worker_id = ? AND status = 'running'",
+                    (json.dumps(result), now, job_id, worker_id)
+                )
+                recorded = cursor.rowcount == 1
+                if recorded and on_recorded:
+                    on_recorded()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return recorded
+
+    def fail(self, job_id, worker_id, error_message):
+        """Reports a worker-side failure: the job is retried until QUEUE_MAX_ATTEMPTS is reached."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "worker_id = NULL, result = ?, updated_at = ? WHERE job_id = ? AND worker_id = ? AND status = 'running'",
+                (QUEUE_MAX_ATTEMPTS, json.dumps({'error_message': error_message}), now, job_id, worker_id)
+            )
+
+    def cancel_run(self, run_id, error_message):
+        """Marks every unfinished job of a run as failed, so no worker picks them up (or completes them) later."""
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'failed', result = ?, updated_at = ? WHERE run_id = ? AND status IN ('pending', 'running')",
+                (json.dumps({'error_message': error_message}), time.time(), run_id)
+            )
+        return cursor.rowcount
+
+    def finished_jobs(self, run_id):
+        """Returns the done/failed jobs of a run with their decoded payload and result."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT job_id, status, payload, result FROM jobs WHERE run_id = ? AND status IN ('done', 'failed')",
+                (run_id,)
+            ).fetchall()
+        return [{'job_id': row['job_id'], 'status': row['status'],
+                 'payload': json.loads(row['payload']), 'result': json.loads(row['result'] or '{}')} for row in rows]
+
+    def pending_count(self, run_id=None):
+        """Number of pending or running jobs (for one run, or overall)."""
+        query = "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')"
+        params = ()
+        if run_id:
+            query += " AND run_id = ?"
+            params = (run_id,)
+        with self.lock:
+            return self.conn.execute(query, params).fetchone()[0]
+
+def queued_result_identity(payload):
+    """Result fields that follow from the queued job itself, never from what its worker reports."""
+    return {
+        'name': payload['url_to_block'],
+        'prefix': payload['prefix'],
+        'suffix': payload['reason'],
+        'blocked_item': payload['url_to_block'],
+        'is_googlebot_view': False,
+        'googlebot_allowed': get_robots_checker().check_url_allowed(payload['url_to_block']), # Cached since discovery
+        'device': payload.get('device', "default"),
+        'scenario': None,
+    }
+
+async def run_distributed_tests(indexed_urls, reason):
+    """Queues the individual tests for remote workers and waits for their results."""
+    run_id = uuid.uuid4().hex[:12]
+    payloads = [{
+        'page_url': PAGE_URL,
+        'discover_mode': DISCOVER_MODE,
+        'url_to_block': url_to_block,
+        'prefix': f"{i+1:02d}",
+        'reason': reason,
+        'device': device,
+        'viewport_widths': VIEWPORT_WIDTHS,
+    } for i, url_to_block in indexed_urls for device in DEVICE_MATRIX]
+    work_queue.enqueue(run_id, payloads)
+    log_message(f"\n--- Queued {len(payloads)} individual blocking tests for remote workers (Run: {run_id}) ---")
+
+    merged = set()
+
+    def merge_finished_jobs():
+        """Records the results of newly finished jobs. Returns True if there were any."""
+        progressed = False
+        for job in work_queue.finished_jobs(run_id):
+            if job['job_id'] in merged:
+                continue
+            merged.add(job['job_id'])
+            progressed = True
+            result = job['result']
+            if job['status'] == 'failed':
+                payload = job['payload']
+                log_message(f"  ERROR: Job {job['job_id']} failed: {result.get('error_message')}")
+                result = dict(queued_result_identity(payload), **{
+                    'screenshot_file': None,
+                    'error': True,
+                    'error_class': 'worker',
+                    'error_message': f"Worker error: {result.get('error_message')}",
+                })
+            else:
+                test_log.extend(result.pop('log', []))
+            observe_test_result(result)
+            record_result(result)
+        return progressed
+
+    last_progress = time.monotonic()
+    while len(merged) < len(payloads):
+        await asyncio.sleep(WORKER_POLL_INTERVAL)
+        if merge_finished_jobs():
+            last_progress = time.monotonic()
+        log_message(f"  Distributed progress: {len(merged)}/{len(payloads)} tests finished.")
+        if len(merged) < len(payloads) and time.monotonic() - last_progress > QUEUE_STALL_TIMEOUT:
+            log_message(f"  ERROR: No worker finished a test for {QUEUE_STALL_TIMEOUT}s, giving up on {len(payloads) - len(merged)} test(s).")
+            # Cancel the remaining jobs so late workers do not render an abandoned run, and record them as errors
+            work_queue.cancel_run(run_id, f"Cancelled: no worker finished a test for {QUEUE_STALL_TIMEOUT}s")
+            merge_finished_jobs()
+            break
+
+def _post_to_coordinator(coordinator_url, path, **kwargs):
+    """Sends a POST to the coordinator and returns the decoded JSON body (or None on 204)."""
+    import requests
+    headers = {'X-Queue-Token': QUEUE_TOKEN} if QUEUE_TOKEN else {}
+    response = requests.post(f"{coordinator_url.rstrip('/')}{path}", timeout=30, headers=headers, **kwargs)
+    response.raise_for_status()
+    if response.status_code == 204:
+        return None
+    return response.json()
+
+async def _send_heartbeats(coordinator_url, job_id, worker_id):
+    """Keeps the lease of a job alive while it is being rendered."""
+    while True:
+        await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+        try:
+            await asyncio.to_thread(_post_to_coordinator, coordinator_url, f"/queue/jobs/{job_id}/heartbeat", json={'worker_id': worker_id})
+        except Exception as e:
+            log_message(f"  Warning: Heartbeat for {job_id} failed: {e}")
+
+async def process_queue_job(browser, coordinator_url, worker_id, job):
+    """Renders one queued test and uploads its result and screenshot to the coordinator."""
+    global PAGE_URL, DISCOVER_MODE, VIEWPORT_WIDTHS, test_results, test_log, circuit_breaker
+    payload = job['payload']
+    PAGE_URL = payload['page_url']
+    DISCOVER_MODE = payload['discover_mode']
+    VIEWPORT_WIDTHS = payload.get('viewport_widths', [])
+    test_results = []
+    test_log = []
+    circuit_breaker = CircuitBreaker() # Origin health is tracked by the coordinator's own run
+    job_id = job['job_id']
+    log_message(f"Worker {worker_id}: running job {job_id} (attempt {job['attempt']})")
 
-async def run_playwright_test_suite():
-    """Runs the complete suite of Playwright tests."""
-    global discovered_resource_paths, test_results, page_url_parsed, page_url_base_path, test_status, test_log
+    heartbeat_task = asyncio.create_task(_send_heartbeats(coordinator_url, job_id, worker_id))
+    try:
+        await run_single_test(browser, payload['url_to_block'], payload['prefix'], payload['reason'], device=payload.get('device', "default"))
+        result = test_results.pop()
+        result['log'] = test_log
+        files = {}
+        screenshot_path = os.path.join(OUTPUT_DIR, result['screenshot_file'] or "")
+        if result['screenshot_file'] and os.path.exists(screenshot_path):
+            files['screenshot'] = (result['screenshot_file'], open(screenshot_path, 'rb'), 'image/png')
+        for n, viewport in enumerate(result.get('viewport_screenshots', [])):
+            viewport_path = os.path.join(OUTPUT_DIR, viewport['screenshot_file'])
+            if os.path.exists(viewport_path):
+                files[f'viewport_{n}'] = (viewport['screenshot_file'], open(viewport_path, 'rb'), 'image/png')
+        try:
+            await asyncio.to_thread(
+                _post_to_coordinator, coordinator_url, f"/queue/jobs/{job_id}/complete",
+                data={'worker_id': worker_id, 'result': json.dumps(result)}, files=files
+            )
+        except Exception as e_upload:
+            if getattr(getattr(e_upload, 'response', None), 'status_code', None) != 409:
+                raise
+            log_message(f"  Result of {job_id} not recorded: the job was already finished or leased to another worker.")
+        finally:
+            for _, file_obj, _ in files.values():
+                file_obj.close()
+    except Exception as e:
+        log_message(f"  ERROR while processing job {job_id}: {e}")
+        try:
+            await asyncio.to_thread(_post_to_coordinator, coordinator_url, f"/queue/jobs/{job_id}/fail",
+                                    json={'worker_id': worker_id, 'error_message': str(e)})
+        except Exception as e_report:
+            log_message(f"  Warning: Could not report failure of {job_id}: {e_report}")
+    finally:
+        heartbeat_task.cancel()
+
+async def run_worker(coordinator_url, worker_id):
+    """Headless worker loop: pulls queued tests from the coordinator and renders them."""
+    global results_journal_enabled
+    results_journal_enabled = False # Results are uploaded to the coordinator, which records them
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    log_message(f"Worker {worker_id} started, pulling jobs from {coordinator_url}")
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        try:
+            while True:
+                try:
+                    job = await asyncio.to_thread(_post_to_coordinator, coordinator_url, "/queue/claim", json={'worker_id': worker_id})
+                except Exception as e:
+                    log_message(f"  Warning: Could not reach coordinator: {e}")
+                    job = None
+                if not job:
+                    await asyncio.sleep(WORKER_POLL_INTERVAL)
+                    continue
+                await process_queue_job(browser, coordinator_url, worker_id, job)
+        finally:
+            await browser.close()
+
+# --- Incremental Re-Audit ---
+def load_incremental_state():
+    """Loads the previous run's state for PAGE_URL: page hash, per-resource hashes, verdicts and results."""
+    state_path = os.path.join(OUTPUT_DIR, INCREMENTAL_STATE_FILE)
+    try:
+        with open(state_path, encoding="utf-8") as f:
+            return json.load(f).get(PAGE_URL, {})
+    except (OSError, ValueError):
+        return {}
+
+def save_incremental_state(list_for_all_block):
+    """Stores this run's resource hashes, robots verdicts and successful results for the next run."""
+    state_path = os.path.join(OUTPUT_DIR, INCREMENTAL_STATE_FILE)
+    try:
+        with open(state_path, encoding="utf-8") as f:
+            all_states = json.load(f)
+    except (OSError, ValueError):
+        all_states = {}
+
+    resources = {}
+    block_all = None
+    for result in test_results:
+        if result['error']:
+            continue
+        device = result.get('device', "default")
+        if result['blocked_item'] == "BLOCK_ALL":
+            if block_all is None:
+                block_all = {'fingerprint': block_all_fingerprint(list_for_all_block), 'results': {}}
+            block_all['results'][device] = result
+        elif result['blocked_item'] in discovered_resource_hashes and discovered_resource_hashes[result['blocked_item']]:
+            entry = resources.setdefault(result['blocked_item'], {
+                'content_hash': discovered_resource_hashes[result['blocked_item']],
+                'googlebot_allowed': result['googlebot_allowed'],
+                'results': {},
+            })
+            entry['results'][device] = result
+    all_states[PAGE_URL] = {'resources': resources, 'block_all': block_all}
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(all_states, f)
+    os.replace(tmp_path, state_path)
+
+def block_all_fingerprint(urls):
+    """Identifies the inputs of the BLOCK_ALL render: the discovered resource set and every resource body.
+       The raw HTML is left out since it usually carries per-request nonces, tokens or timestamps.
+    """
+    digest = hashlib.sha256()
+    for url in sorted(urls):
+        digest.update(f"\n{url}={discovered_resource_hashes.get(url)}".encode())
+    return digest.hexdigest()
+
+def previous_device_results(entry):
+    """Returns the previous results of a state entry for every device of DEVICE_MATRIX, or None if one is missing.
+       States written before the device matrix hold a single 'result', rendered with the default device.
+    """
+    results = entry.get('results') or {"default": entry.get('result')}
+    if not all(results.get(device) for device in DEVICE_MATRIX):
+        return None
+    return [results[device] for device in DEVICE_MATRIX]
+
+def reuse_previous_results(previous_results, file_prefix, staged=None):
+    """Re-records the previous results of every device under this run's prefix.
+       Returns False, recording nothing, if one of their screenshots is gone.
+    """
+    staged = staged or {}
+    if not all(r['screenshot_file'] and os.path.exists(staged.get(r['screenshot_file'], os.path.join(OUTPUT_DIR, r['screenshot_file'])))
+               for r in previous_results):
+        return False
+    return all(reuse_previous_result(r, file_prefix, staged) for r in previous_results)
+
+def stage_previous_screenshots(previous_results, staging_dir):
+    """Copies the screenshots of previous results aside before any of them is renamed.
+       Prefixes shift when resources are added or removed, and resources differing only by
+       their query string share a file name, so renaming in place could overwrite a file
+       that another reused result still has to copy. Returns {file name: staged path}.
+    """
+    staged = {}
+    for previous_result in previous_results:
+        filenames = [previous_result['screenshot_file']] + [v['screenshot_file'] for v in previous_result.get('viewport_screenshots', [])]
+        for filename in filter(None, filenames):
+            old_path = os.path.join(OUTPUT_DIR, filename)
+            if filename not in staged and os.path.exists(old_path):
+                os.makedirs(staging_dir, exist_ok=True)
+                staged[filename] = os.path.join(staging_dir, filename)
+                shutil.copyfile(old_path, staged[filename])
+    return staged
+
+def reuse_previous_result(previous_result, file_prefix, staged=None):
+    """Re-records a previous result under this run's prefix, copying its screenshots if they were renamed.
+       staged maps previous file names to copies taken before any rename (see stage_previous_screenshots).
+       Returns False if the previous screenshot is gone.
+    """
+    staged = staged or {}
+
+    def source_path(filename):
+        return staged.get(filename, os.path.join(OUTPUT_DIR, filename))
+
+    if not previous_result['screenshot_file'] or not os.path.exists(source_path(previous_result['screenshot_file'])):
+        return False
+    result = dict(previous_result, prefix=file_prefix, reused=True)
+    result['screenshot_file'] = previous_result['screenshot_file'].replace(f"{previous_result['prefix']}_", f"{file_prefix}_", 1)
+    if result['screenshot_file'] != previous_result['screenshot_file']:
+        shutil.copyfile(source_path(previous_result['screenshot_file']), os.path.join(OUTPUT_DIR, result['screenshot_file']))
+    result['viewport_screenshots'] = []
+    for viewport in previous_result.get('viewport_screenshots', []):
+        if not os.path.exists(source_path(viewport['screenshot_file'])):
+            continue
+        new_viewport = dict(viewport, screenshot_file=viewport['screenshot_file'].replace(f"{previous_result['prefix']}_", f"{file_prefix}_", 1))
+        if new_viewport['screenshot_file'] != viewport['screenshot_file']:
+            shutil.copyfile(source_path(viewport['screenshot_file']), os.path.join(OUTPUT_DIR, new_viewport['screenshot_file']))
+        result['viewport_screenshots'].append(new_viewport)
+    METRIC_TESTS.inc(status="reused")
+    record_result(result)
+    return True
+
+def reuse_unchanged_results(indexed_urls, previous_state):
+    """Records previous results for resources whose URL, body and robots verdict are unchanged.
+       Returns the (index, url) pairs that still need to be rendered.
+    """
+    if not previous_state:
+        log_message("  Incremental: no previous state, every resource is re-rendered.")
+        return indexed_urls
+
+    reusable = {} # index -> previous results of every device
+    previous_resources = previous_state.get('resources', {})
+    for i, url in indexed_urls:
+        previous = previous_resources.get(url)
+        content_hash = discovered_resource_hashes.get(url)
+        unchanged = (
+            previous is not None
+            and content_hash is not None
+            and previous['content_hash'] == content_hash
+            and previous['googlebot_allowed'] == get_robots_checker().check_url_allowed(url)
+        )
+        # A resource is only reused when every device of the matrix has a previous result
+        previous_results = previous_device_results(previous) if unchanged else None
+        if previous_results:
+            reusable[i] = previous_results
+
+    to_render = []
+    staging_dir = os.path.join(OUTPUT_DIR, f".reuse_{uuid.uuid4().hex}")
+    try:
+        staged = stage_previous_screenshots([r for results in reusable.values() for r in results], staging_dir)
+        for i, url in indexed_urls:
+            if i in reusable and reuse_previous_results(reusable[i], f"{i+1:02d}", staged):
+                continue
+            to_render.append((i, url))
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    log_message(f"  Incremental: reusing {len(indexed_urls) - len(to_render)} unchanged result(s), re-rendering {len(to_render)}.")
+    return to_render
+
+def result_sort_key(result):
+    """Test order: numeric prefixes first (00, 01 ... 99, 100), then scenarios, then devices in DEVICE_MATRIX order."""
+    device = result.get('device', "default")
+    return (int(result['prefix']) if result['prefix'].isdigit() else 999, result['prefix'], result.get('suffix') or "",
+            DEVICE_MATRIX.index(device) if device in DEVICE_MATRIX else len(DEVICE_MATRIX))
+
+async def _close_browser(browser):
+    if browser.is_connected():
+        await browser.close()
+
+async def run_playwright_test_suite(browser=None):
+    """Runs the complete suite of Playwright tests.
+       Uses the given (shared) browser if provided, otherwise launches and closes its own.
+    """
+    global discovered_resource_paths, test_results, page_url_parsed, page_url_base_path, test_status, test_log, circuit_breaker, run_timings
 
     # --- Input Validation ---
     if not PAGE_URL or not (PAGE_URL.startswith("http://") or PAGE_URL.startswith("https://")):
@@ -381,7 +1607,15 @@ async def run_playwright_test_suite():
     test_status = "running"
     test_results = []
     discovered_resource_paths = set()
+    discovered_resource_hashes.clear()
+    discovered_resource_meta.clear()
     test_log = []
+    circuit_breaker = CircuitBreaker()
+    run_timings = []
+    phase_stats.clear()
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    reset_result_exports()
+    run_start = time.perf_counter()
 
     # Parse the main URL once
     try:
@@ -397,43 +1631,63 @@ async def run_playwright_test_suite():
     log_message(f"Mode: {'Discovery' if DISCOVER_MODE else 'Predefined List'}")
     log_message(f"Output Directory: {OUTPUT_DIR}")
 
-    async with async_playwright() as p:
-        browser = None
+    owns_browser = browser is None
+    # A shared browser lives on the BrowserLoop, which already monitors its own lag
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag()) if owns_browser else None
+    async with AsyncExitStack() as stack:
         try:
-            browser = await p.chromium.launch(headless=True)
-            log_message("Browser launched.")
+            if owns_browser:
+                p = await stack.enter_async_context(async_playwright())
+                browser = await p.chromium.launch(headless=True)
+                stack.push_async_callback(_close_browser, browser)
+                log_message("Browser launched.")
+
+            if DEVICE_MATRIX != ["default"] or VIEWPORT_WIDTHS:
+                log_message(f"Devices: {', '.join(DEVICE_MATRIX)}" + (f" (extra widths: {', '.join(map(str, VIEWPORT_WIDTHS))})" if VIEWPORT_WIDTHS else ""))
 
             # --- Run 0: Googlebot View (respects robots.txt) ---
-            await run_single_test(browser, None, "00", "_googlebot_view", is_googlebot_view=True)
+            await run_test_batches(browser, for_each_device([
+                {'url_to_block': None, 'file_prefix': "00", 'reason_suffix': "_googlebot_view", 'is_googlebot_view': True}
+            ]))
 
             # --- Run 1: Reference Screenshot (no blocking) ---
-            await run_single_test(browser, None, "01", "_reference")
+            await run_test_batches(browser, for_each_device([{'url_to_block': None, 'file_prefix': "01", 'reason_suffix': "_reference"}]))
+            reference_results = test_results[-len(DEVICE_MATRIX):]
+            # The origin is only considered down if no device could render the reference
+            if all(r['error'] and r['error_class'] in ORIGIN_ERROR_CLASSES | {"timeout"} for r in reference_results):
+                reference_result = reference_results[0]
+                circuit_breaker.trip(f"reference render failed ({reference_result['error_class']}): {reference_result['error_message']}")
 
             urls_to_test = []
             list_for_all_block = []
             reason = ""
-            CONCURRENCY = 5
+            incremental = INCREMENTAL_MODE and DISCOVER_MODE
 
             # --- Determine URLs to block ---
-            if DISCOVER_MODE:
+            if circuit_breaker.is_open:
+                log_message("\nSkipping discovery and blocking tests: the origin looks unreachable.")
+            elif DISCOVER_MODE:
                 log_message("\n--- Discovery Phase: Finding all resources ---")
                 log_message("WARNING: Discovery mode can be slow and generate many screenshots.")
                 context_discover = None
                 page_discover = None
                 try:
-                    context_discover = await browser.new_context(
-                         user_agent="Mozilla/5.0 (Linux; Android 6.0.1; Nexus 5X Build/MMB29P) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/W.X.Y.Z Mobile Safari/537.36 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"
-                    )
+                    context_discover = await browser.new_context(**DEVICES[DEVICE_MATRIX[0]])
                     page_discover = await context_discover.new_page()
                     page_discover.on("response", handle_response_for_discovery)
                     log_message(f"  Navigating to {PAGE_URL} for discovery...")
-                    await page_discover.goto(PAGE_URL, wait_until="networkidle", timeout=90000)
+                    with timing_span(run_timings, "discovery", run_start):
+                        await page_discover.goto(PAGE_URL, wait_until="networkidle", timeout=GOTO_TIMEOUT_MS)
                     log_message(f"  Page loaded ('networkidle'). Discovery finished.")
                     page_discover.remove_listener("response", handle_response_for_discovery)
                     log_message(f"--- Discovery complete: Found {len(discovered_resource_paths)} base resource URL(s) ---")
                     urls_to_test = sorted(list(discovered_resource_paths))
                     list_for_all_block = urls_to_test
                     reason = "_discovered"
+                    # Fetch robots.txt of every discovered host off the event loop, so later synchronous
+                    # verdicts (incremental reuse, distributed results) only hit the cache
+                    await asyncio.gather(*(get_robots_checker().ensure_robots_loaded(url)
+                                           for url in set(urls_to_test) | set(discovered_resource_meta)))
 
                 except Exception as e_discover:
                     log_message(f"  ERROR during discovery phase: {e_discover}")
@@ -454,35 +1708,310 @@ async def run_playwright_test_suite():
             if not urls_to_test:
                 log_message("\nWARNING: No URLs found or defined to test for blocking.")
             else:
-                log_message(f"\n--- Starting {len(urls_to_test)} individual blocking tests (Concurrency: {CONCURRENCY}) ---")
-                tasks = []
-                for i, url_to_block in enumerate(urls_to_test):
-                    task = asyncio.create_task(run_single_test(browser, url_to_block, f"{i+1:02d}", reason))
-                    tasks.append(task)
-
-                for i in range(0, len(tasks), CONCURRENCY):
-                    batch = tasks[i:i + CONCURRENCY]
-                    log_message(f"  Running batch {i // CONCURRENCY + 1} ({len(batch)} tests)...")
-                    await asyncio.gather(*batch)
-                    log_message(f"  Batch {i // CONCURRENCY + 1} finished.")
+                indexed_urls = list(enumerate(urls_to_test))
+                previous_state = {}
+                if incremental:
+                    previous_state = load_incremental_state()
+                    indexed_urls = reuse_unchanged_results(indexed_urls, previous_state)
+                with timing_span(run_timings, "individual_tests", run_start):
+                    if not indexed_urls:
+                        pass # Every result was reused
+                    elif work_queue is not None:
+                        await run_distributed_tests(indexed_urls, reason)
+                    elif WORKERS > 1 and len(indexed_urls) > 1:
+                        await run_sharded_tests(indexed_urls, reason)
+                    else:
+                        log_message(f"\n--- Starting {len(indexed_urls)} individual blocking tests (Concurrency: {CONCURRENCY}) ---")
+                        await run_individual_tests(browser, indexed_urls, reason)
 
                 # --- Run 3: Block All Test ---
-                await run_single_test(browser, "BLOCK_ALL", "99", "_all", is_combined_block=True, block_list_for_all=list_for_all_block)
+                previous_block_all = previous_state.get('block_all')
+                previous_block_all_results = previous_device_results(previous_block_all) if previous_block_all else None
+                if (incremental and previous_block_all_results
+                        and previous_block_all['fingerprint'] == block_all_fingerprint(list_for_all_block)
+                        and reuse_previous_results(previous_block_all_results, "99")):
+                    log_message("  Incremental: BLOCK_ALL inputs unchanged, previous result reused.")
+                else:
+                    await run_test_batches(browser, for_each_device([
+                        {'url_to_block': "BLOCK_ALL", 'file_prefix': "99", 'reason_suffix': "_all",
+                         'is_combined_block': True, 'block_list_for_all': list_for_all_block}
+                    ]))
+
+            if circuit_breaker.is_open:
+                log_message(f"\n--- Run aborted: {circuit_breaker.reason} ---")
+                test_status = "error"
+                return False
+
+            # --- Run 4: Grouped Scenarios ---
+            if SCENARIOS_MODE and DISCOVER_MODE and discovered_resource_meta and not circuit_breaker.is_open:
+                scenarios = build_scenarios()
+                log_message(f"\n--- Starting {len(scenarios)} grouped blocking scenarios (from {len(discovered_resource_meta)} discovered resources) ---")
+                with timing_span(run_timings, "scenarios", run_start):
+                    await run_test_batches(browser, for_each_device([
+                        {'url_to_block': None, 'file_prefix': f"S{n:02d}", 'reason_suffix': "_scenario", 'scenario': scenario}
+                        for n, scenario in enumerate(scenarios, 1)
+                    ]))
+
+            compute_impact_scores()
+            finalize_result_exports()
+            if incremental and urls_to_test: # An empty discovery (e.g. a failed load) keeps the previous state
+                save_incremental_state(list_for_all_block)
 
-            await browser.close()
             log_message("\n--- Playwright tests finished ---")
             log_message(f"Screenshots saved in directory: {OUTPUT_DIR}")
-            test_results.sort(key=lambda x: (int(x['prefix']) if x['prefix'].isdigit() else 999, x['suffix']))
+            log_message(f"Total time: {time.perf_counter() - run_start:.1f}s. Time per phase:")
+            for phase, entry in build_timing_summary().items():
+                log_message(f"  {phase}: {entry['total_ms'] / 1000:.1f}s total over {entry['count']} call(s), mean {entry['mean_ms']:.0f} ms, max {entry['max_ms']:.0f} ms")
+            test_results.sort(key=result_sort_key)
             test_status = "completed"
             return True
 
         except Exception as e_main:
              log_message(f"\n--- CRITICAL ERROR during Playwright execution: {e_main} ---")
-             if browser and browser.is_connected():
-                 await browser.close()
              test_status = "error"
              return False
+        finally:
+            if lag_monitor:
+                lag_monitor.cancel()
+            METRIC_RUNS.inc(status=test_status)
+
+
+# --- Result Export ---
+export_lock = threading.Lock()
+
+def journal_path():
+    return os.path.join(OUTPUT_DIR, RESULTS_JOURNAL_FILE)
+
+def csv_row(result):
+    """Flattens a result into the EXPORT_CSV_FIELDS columns."""
+    return [result.get(field) for field in EXPORT_CSV_FIELDS]
+
+def format_export_lines(path, results, with_header):
+    """Serializes results as JSONL or CSV lines depending on the extension of path."""
+    if not path.endswith(".csv"):
+        return "".join(json.dumps(result) + "\n" for result in results)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if with_header:
+        writer.writerow(EXPORT_CSV_FIELDS)
+    writer.writerows(csv_row(result) for result in results)
+    return buffer.getvalue()
+
+def export_targets():
+    return ([journal_path()] if results_journal_enabled else []) + export_paths
+
+def record_result(result):
+    """Adds a finished test to the current run and appends it to the journal and --export files."""
+    test_results.append(result)
+    if shard_events is not None:
+        shard_events.put(("result", result))
+    with export_lock:
+        for path in export_targets():
+            with open(path, "a", encoding="utf-8", newline="") as f:
+                f.write(format_export_lines(path, [result], with_header=f.tell() == 0))
+
+def reset_result_exports():
+    """Empties the journal and --export files at the start of a run."""
+    with export_lock:
+        for path in export_targets():
+            open(path, "w").close()
+
+def finalize_result_exports():
+    """Rewrites the journal and --export files in test order, now that impact scores are known.
+       The new file replaces the old one atomically, so a reader never sees a partial journal.
+    """
+    with export_lock:
+        for path in export_targets():
+            tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+            with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+                f.write(format_export_lines(path, [], with_header=True))
+                for result in test_results:
+                    f.write(format_export_lines(path, [result], with_header=False))
+            os.replace(tmp_path, path)
+
+def open_journal():
+    """Opens the journal for reading (an empty one if no run recorded results yet)."""
+    try:
+        return open(journal_path(), encoding="utf-8")
+    except OSError:
+        return io.StringIO()
+
+def journal_truncated(journal):
+    """True if the journal was emptied under an open reader, i.e. a new run started since it was opened."""
+    try:
+        return os.fstat(journal.fileno()).st_size < journal.tell()
+    except (OSError, ValueError): # io.StringIO placeholder
+        return False
+
+def read_journal_lines(journal, follow=False, limit=None):
+    """Yields the complete JSON lines of an open journal, one at a time.
+       With follow, keeps waiting for new results until the current run is over, and starts
+       over from the beginning if the journal is emptied for a new run meanwhile.
+    """
+    count = 0
+    pending = ""
+    while limit is None or count < limit:
+        pending += journal.readline()
+        if pending.endswith("\n"):
+            # Only complete lines: the run may be halfway through writing the last one
+            yield pending
+            pending = ""
+            count += 1
+        elif follow and journal_truncated(journal):
+            journal.seek(0)
+            pending = ""
+        elif follow and test_status in ("starting", "running"):
+            time.sleep(EXPORT_FOLLOW_INTERVAL)
+        else:
+            break
+
+def iter_journal(follow=False):
+    with open_journal() as journal:
+        yield from read_journal_lines(journal, follow)
+
+def iter_csv_export(follow=False):
+    """Yields the journal as CSV, one row at a time."""
+    yield format_export_lines(".csv", [], with_header=True)
+    for line in iter_journal(follow):
+        yield format_export_lines(".csv", [json.loads(line)], with_header=False)
 
+class ZipStream:
+    """Write-only, non-seekable file object collecting the bytes written by ZipFile until they are yielded."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_zip_export():
+    """Yields a ZIP of every screenshot, viewport screenshot and thumbnail of the run, plus a
+       manifest.jsonl of the results, file by file. ZipFile writes data descriptors since the
+       stream cannot seek, so nothing beyond one file is held in memory.
+    """
+    stream = ZipStream()
+    count = 0
+    # PNG and JPEG files are already compressed, only the manifest is deflated
+    with open_journal() as journal, zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as archive:
+        for line in read_journal_lines(journal):
+            count += 1
+            result = json.loads(line)
+            filenames = [result.get('screenshot_file')] + [v['screenshot_file'] for v in result.get('viewport_screenshots', [])]
+            for filename in filter(None, filenames):
+                path = os.path.join(OUTPUT_DIR, filename)
+                if not os.path.exists(path):
+                    continue
+                archive.write(path, f"screenshots/{filename}")
+                yield stream.drain()
+                thumbnail_path = get_thumbnail_path(filename)
+                if thumbnail_path:
+                    archive.write(thumbnail_path, os.path.relpath(thumbnail_path, OUTPUT_DIR))
+                    yield stream.drain()
+        # Re-read the same file so the manifest lists exactly the archived results,
+        # even if more were recorded (or the journal was rewritten) meanwhile
+        journal.seek(0)
+        manifest_info = zipfile.ZipInfo("manifest.jsonl", date_time=time.localtime()[:6])
+        manifest_info.compress_type = zipfile.ZIP_DEFLATED
+        with archive.open(manifest_info, "w", force_zip64=True) as manifest:
+            for line in read_journal_lines(journal, limit=count):
+                manifest.write(line.encode("utf-8"))
+        yield stream.drain()
+    yield stream.drain() # Central directory
+
+def write_zip_export(path):
+    """Writes the ZIP export to a file (CLI)."""
+    with open(path, "wb") as f:
+        for chunk in iter_zip_export():
+            f.write(chunk)
+
+# --- Shared Browser Loop ---
+class BrowserLoop:
+    """Owns one long-lived asyncio event loop (in a background thread) and the shared Chromium.
+
+    Flask request threads hand coroutines to this loop with submit() and wait on the returned
+    future, so every run and measurement shares one event loop and one browser instead of
+    creating a new loop and browser per request.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.playwright = None
+        self.browser = None
+        self.browser_lock = None
+        self.start_lock = threading.Lock()
+
+    def start(self):
+        with self.start_lock:
+            if self.thread is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self._run, name="browser-loop", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.browser_lock = asyncio.Lock()
+        self.loop.create_task(monitor_event_loop_lag())
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Schedules a coroutine on the browser loop and returns a concurrent.futures.Future."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def get_browser(self):
+        """Returns the shared browser, launching (or relaunching after a crash) on demand."""
+        async with self.browser_lock:
+            if self.browser is None or not self.browser.is_connected():
+                if self.playwright is None:
+                    self.playwright = await async_playwright().start()
+                self.browser = await self.playwright.chromium.launch(headless=True)
+                log_message("Shared browser launched.")
+            return self.browser
+
+browser_loop = BrowserLoop()
+run_start_lock = threading.Lock() # Serializes the check-and-set of test_status in /start
+check_impact_slots = threading.BoundedSemaphore(CHECK_IMPACT_MAX_PENDING)
+
+async def run_suite_on_shared_browser():
+    """Runs the test suite on the shared browser of the BrowserLoop."""
+    global test_status
+    try:
+        with profiling("run"):
+            await run_playwright_test_suite(await browser_loop.get_browser())
+    except Exception as e:
+        log_message(f"FATAL ERROR running tests: {e}")
+        test_status = "error"
+
+LOAD_TIME_SCRIPT = '() => ({loadTime: window.performance.timing.loadEventEnd - window.performance.timing.navigationStart})'
+
+async def measure_load_impact(url):
+    """Measures the page load time with and without images, CSS and JS, on the shared browser."""
+    browser = await browser_loop.get_browser()
+    timings = {}
+    for label, blocked in (("normal", False), ("blocked", True)):
+        context = await browser.new_context()
+        METRIC_CONTEXTS_OPEN.inc()
+        try:
+            page = await context.new_page()
+            if blocked:
+                await page.route("**/*.{png,jpg,jpeg,gif,webp,css,js}", lambda route: route.abort())
+            await page.goto(url, timeout=GOTO_TIMEOUT_MS)
+            timings[label] = await page.evaluate(LOAD_TIME_SCRIPT)
+        finally:
+            METRIC_CONTEXTS_OPEN.inc(-1)
+            await context.close()
+    return timings["normal"]["loadTime"], timings["blocked"]["loadTime"]
 
 # --- Flask Logic ---
 
@@ -615,6 +2144,29 @@ FLASK_TEMPLATE = """
             border: 1px solid #ffeeba;
         }
         
+        .timings { margin-top: 10px; font-size: 0.8em; color: #495057; }
+        .timings summary { cursor: pointer; }
+        .timing-row { display: flex; align-items: center; gap: 6px; margin: 2px 0; }
+        .timing-label { width: 110px; flex-shrink: 0; font-family: monospace; }
+        .timing-track { position: relative; flex: 1; height: 8px; background-color: #e9ecef; border-radius: 2px; }
+        .timing-bar { position: absolute; top: 0; height: 8px; background-color: #007bff; border-radius: 2px; }
+        .timing-value { width: 70px; flex-shrink: 0; text-align: right; font-family: monospace; }
+
+        .impact-matrix { border-collapse: collapse; margin: 10px auto 20px auto; font-size: 0.9em; }
+        .impact-matrix th, .impact-matrix td { border: 1px solid #dee2e6; padding: 6px 10px; text-align: center; }
+        .impact-matrix th { background-color: #f8f9fa; font-weight: 500; word-break: break-all; }
+        .impact-cell { cursor: pointer; font-family: monospace; }
+        .impact-empty { color: #adb5bd; }
+
+        .results-filters { display: flex; flex-wrap: wrap; gap: 15px; align-items: center; margin: 10px 0 20px 0; font-size: 0.9em; }
+        .results-filters select, .results-filters input { padding: 4px; border: 1px solid #ced4da; border-radius: 4px; }
+        .pagination { display: flex; justify-content: center; align-items: center; gap: 15px; margin-top: 20px; }
+        .pagination button { padding: 6px 12px; border: 1px solid #ced4da; border-radius: 4px; background: white; cursor: pointer; }
+        .pagination button:disabled { cursor: default; color: #adb5bd; }
+        .impact-badge { font-family: monospace; font-size: 0.85em; color: #495057; }
+        .viewport-links { font-size: 0.85em; margin-top: 5px; }
+        .viewport-links a { margin-right: 6px; }
+
         .no-blocked-resources {
             background-color: #d4edda;
             color: #155724;
@@ -642,6 +2194,12 @@ FLASK_TEMPLATE = """
                     <label>
                         <input type="radio" name="mode" value="discover" {{ 'checked' if discover_mode else 'checked' }} onclick="toggleUrlList(this)"> Discover All Resources (Slow)
                     </label>
+                    <label>
+                        <input type="checkbox" name="incremental" {{ 'checked' if incremental_mode else '' }}> Incremental (reuse unchanged resources, discovery only)
+                    </label>
+                    <label>
+                        <input type="checkbox" name="scenarios" {{ 'checked' if scenarios_mode else '' }}> Grouped scenarios (third-party, per type, per host, discovery only)
+                    </label>
                     <div id="urlListContainer" style="margin-top: 15px; {{ 'display: none;' if discover_mode else 'display: none;' }}">
                         <label for="url_list">URLs to block (one per line):</label>
                         <textarea id="url_list" name="url_list" rows="5" style="width: 100%; margin-top: 8px; padding: 8px; border: 1px solid #ced4da; border-radius: 4px;" placeholder="https://example.com/script.js&#10;https://example.com/style.css">{{ '\n'.join(predefined_urls) if predefined_urls else '' }}</textarea>
@@ -678,42 +2236,68 @@ FLASK_TEMPLATE = """
         </div>
         {% endif %}
 
-        {% if results %}
+        <div id="results-section" style="{{ '' if has_results else 'display: none;' }}">
         <h2>Test Results</h2>
-        
-        {# Filter results to keep only blocked resources #}
-        {% set blocked_resources = [] %}
-        {% for result in results %}
-            {% if result.googlebot_allowed is defined and result.googlebot_allowed == false %}
-                {% set _ = blocked_resources.append(result) %}
+
+        <div id="impact-section" style="display: none;">
+            <h3>Scenario Impact</h3>
+            <p class="mode-info">Impact score: 0% renders like the reference, 100% has nothing in common with it (page height, text, elements, loaded images). Click a score to see the screenshot.</p>
+            <table class="impact-matrix" id="impact-matrix"></table>
+        </div>
+
+        <div class="results-filters">
+            {% if devices|length > 1 %}
+            <label>Device:
+                <select id="filter-device">
+                    <option value="" selected>All devices</option>
+                    {% for device in devices %}
+                    <option value="{{ device }}">{{ device }}</option>
+                    {% endfor %}
+                </select>
+            </label>
             {% endif %}
-        {% endfor %}
-
-        {% if blocked_resources|length > 0 %}
-            <div class="blocked-resources-summary">
-                <h3>⚠️ {{ blocked_resources|length }} resource(s) blocked for Googlebot</h3>
-            </div>
-            <div class="test-grid">
-                {% for result in blocked_resources %}
-                <div class="test-case {% if result.error %}error{% endif %}">
-                    <span class="blocked-item" title="{{ result.blocked_item | e }}">{{ result.blocked_item | e }}</span>
-                    <div class="screenshot-container">
-                        <img src="{{ url_for('serve_screenshot', filename=result.screenshot_file) }}"
-                             alt="Screenshot for {{ result.name | e }}"
-                             class="screenshot"
-                             loading="lazy"
-                             onclick="showFullscreen('{{ url_for('serve_screenshot', filename=result.screenshot_file) }}')"
-                             onerror="this.alt='Screenshot not found'; this.style.display='none';">
-                    </div>
-                </div>
-                {% endfor %}
-            </div>
-        {% else %}
-            <div class="no-blocked-resources">
-                ✅ No resources are blocked for Google robots.
-            </div>
-        {% endif %}
-        {% endif %}
+            <label>Googlebot:
+                <select id="filter-googlebot">
+                    <option value="false" selected>Blocked for Googlebot</option>
+                    <option value="true">Allowed for Googlebot</option>
+                    <option value="">All results</option>
+                </select>
+            </label>
+            <label>Errors:
+                <select id="filter-error">
+                    <option value="" selected>All</option>
+                    <option value="true">Only errors</option>
+                    <option value="false">No errors</option>
+                </select>
+            </label>
+            <label>Min. impact:
+                <input type="number" id="filter-min-impact" min="0" max="100" step="5" value="0" style="width: 4em;">%
+            </label>
+            <label>Sort:
+                <select id="filter-sort">
+                    <option value="prefix" selected>Test order</option>
+                    <option value="impact_score">Impact score</option>
+                    <option value="duration_ms">Duration</option>
+                    <option value="blocked_item">Blocked resource</option>
+                </select>
+            </label>
+            <label>
+                <select id="filter-order">
+                    <option value="asc" selected>Ascending</option>
+                    <option value="desc">Descending</option>
+                </select>
+            </label>
+        </div>
+
+        <p class="mode-info">Export: <a href="/export/results.jsonl">JSONL</a> | <a href="/export/results.csv">CSV</a> | <a href="/export/screenshots.zip">Screenshots (ZIP)</a></p>
+        <div id="results-summary"></div>
+        <div class="test-grid" id="results-grid"></div>
+        <div class="pagination">
+            <button type="button" id="page-prev">&laquo; Previous</button>
+            <span id="page-info"></span>
+            <button type="button" id="page-next">Next &raquo;</button>
+        </div>
+        </div>
     </div>
 
     <div id="fullscreen-overlay" class="fullscreen-overlay" onclick="hideFullscreen()">
@@ -779,13 +2363,16 @@ FLASK_TEMPLATE = """
                 }
 
 
-                // If tests are completed or errored, reload the page to show results grid
+                // Refresh the results grid in place (results arrive while tests are running)
+                loadResults();
                 if (data.status === 'completed' || data.status === 'error') {
-                     // Optionally add a small delay before reloading
-                     setTimeout(() => {
-                         window.location.reload();
-                     }, 1500); // Reload after 1.5 seconds to ensure results are processed
-                } else if (data.status === 'running') {
+                    loadImpactMatrix();
+                    const submitButton = document.querySelector('.form-container input[type="submit"]');
+                    if (submitButton) {
+                        submitButton.disabled = false;
+                        submitButton.value = 'Start Tests';
+                    }
+                } else if (data.status === 'running' || data.status === 'starting') {
                     // If still running, schedule the next update
                     setTimeout(updateStatus, 2000); // Poll every 2 seconds
                 }
@@ -799,7 +2386,7 @@ FLASK_TEMPLATE = """
         // Start polling if the page indicates tests might be running or just finished
         // Check initial status passed from template or assume polling needed if status is 'running'
         const initialStatus = "{{ test_status }}";
-        if (initialStatus === 'running') {
+        if (initialStatus === 'running' || initialStatus === 'starting') {
              // Disable form submit button while running
              const submitButton = document.querySelector('.form-container input[type="submit"]');
              if (submitButton) submitButton.disabled = true;
@@ -820,6 +2407,147 @@ FLASK_TEMPLATE = """
              });
          }
 
+        // --- Results grid (fetched page by page from /api/results) ---
+        const PER_PAGE = 24;
+        let currentPage = 1;
+
+        function escapeHtml(value) {
+            const div = document.createElement('div');
+            div.textContent = value == null ? '' : String(value);
+            return div.innerHTML;
+        }
+
+        function formatImpact(score) {
+            return score == null ? 'n/a' : `${Math.round(score * 100)}%`;
+        }
+
+        function renderTimings(result) {
+            if (!result.timings || !result.timings.length || !result.duration_ms) return '';
+            const rows = result.timings.map(span => `
+                <div class="timing-row">
+                    <span class="timing-label">${escapeHtml(span.phase)}</span>
+                    <span class="timing-track"><span class="timing-bar" style="left: ${(100 * span.start_ms / result.duration_ms).toFixed(1)}%; width: ${Math.max(100 * span.duration_ms / result.duration_ms, 0.5).toFixed(1)}%;"></span></span>
+                    <span class="timing-value">${Math.round(span.duration_ms)} ms</span>
+                </div>`).join('');
+            return `<details class="timings"><summary>Timings (${Math.round(result.duration_ms)} ms)</summary>${rows}</details>`;
+        }
+
+        function renderResult(result) {
+            const card = document.createElement('div');
+            card.className = 'test-case' + (result.error ? ' error' : '');
+            let html = `<span class="blocked-item" title="${escapeHtml(result.blocked_item)}">${escapeHtml(result.blocked_item)}</span>`;
+            html += `<span class="impact-badge">Impact: ${formatImpact(result.impact_score)}${result.reused ? ' (reused)' : ''}</span>`;
+            if (result.device && result.device !== 'default') {
+                html += ` <span class="impact-badge">${escapeHtml(result.device)}</span>`;
+            }
+            if (result.error) {
+                html += `<div class="error-message">${escapeHtml(result.error_class || 'error')}: ${escapeHtml(result.error_message)}</div>`;
+            }
+            if (result.thumbnail_url) {
+                html += `<div class="screenshot-container">
+                    <img src="${result.thumbnail_url}" alt="Screenshot for ${escapeHtml(result.name)}" class="screenshot" loading="lazy"
+                         onclick="showFullscreen('${result.screenshot_url}')"
+                         onerror="this.alt='Screenshot not found'; this.style.display='none';">
+                </div>`;
+            }
+            if (result.viewports && result.viewports.length) {
+                html += '<div class="viewport-links">Widths: ' + result.viewports.map(viewport =>
+                    `<a href="#" onclick="showFullscreen('${viewport.screenshot_url}'); return false;">${viewport.width}px</a>`).join(' ') + '</div>';
+            }
+            html += renderTimings(result);
+            card.innerHTML = html;
+            return card;
+        }
+
+        async function loadResults(page) {
+            if (page) currentPage = page;
+            const params = new URLSearchParams({
+                page: currentPage,
+                per_page: PER_PAGE,
+                sort: document.getElementById('filter-sort').value,
+                order: document.getElementById('filter-order').value,
+                googlebot_allowed: document.getElementById('filter-googlebot').value,
+                error: document.getElementById('filter-error').value,
+                min_impact: (parseFloat(document.getElementById('filter-min-impact').value) || 0) / 100,
+                device: selectedDevice(),
+            });
+            try {
+                const response = await fetch(`/api/results?${params}`);
+                if (!response.ok) return;
+                const data = await response.json();
+                document.getElementById('results-section').style.display = data.run_total ? '' : 'none';
+
+                const summary = document.getElementById('results-summary');
+                if (params.get('googlebot_allowed') === 'false') {
+                    summary.innerHTML = data.total
+                        ? `<div class="blocked-resources-summary"><h3>⚠️ ${data.total} resource(s) blocked for Googlebot</h3></div>`
+                        : '<div class="no-blocked-resources">✅ No resources are blocked for Google robots.</div>';
+                } else {
+                    summary.innerHTML = `<p class="mode-info">${data.total} matching result(s)</p>`;
+                }
+
+                const grid = document.getElementById('results-grid');
+                grid.replaceChildren(...data.results.map(renderResult));
+                document.getElementById('page-info').textContent = `Page ${data.page} of ${Math.max(data.pages, 1)}`;
+                document.getElementById('page-prev').disabled = data.page <= 1;
+                document.getElementById('page-next').disabled = data.page >= data.pages;
+            } catch (error) {
+                console.error("Error fetching results:", error);
+            }
+        }
+
+        function selectedDevice() {
+            const select = document.getElementById('filter-device');
+            return select ? select.value : '';
+        }
+
+        async function loadImpactMatrix() {
+            try {
+                const response = await fetch(`/scenarios?${new URLSearchParams({device: selectedDevice()})}`);
+                if (!response.ok) return;
+                const matrix = await response.json();
+                const section = document.getElementById('impact-section');
+                if (!matrix.aggregates.length && !matrix.hosts.length) {
+                    section.style.display = 'none';
+                    return;
+                }
+                const cell = entry => {
+                    const onclick = entry.screenshot_file ? ` onclick="showFullscreen('/screenshots/${encodeURIComponent(entry.screenshot_file)}')"` : '';
+                    const text = entry.error ? 'error' : formatImpact(entry.impact_score);
+                    return `<td class="impact-cell" style="background-color: rgba(220, 53, 69, ${entry.impact_score || 0});" title="${escapeHtml(entry.label)}"${onclick}>${text}</td>`;
+                };
+                let html = matrix.aggregates.map(entry =>
+                    `<tr><th colspan="${Math.max(matrix.types.length, 1)}">${escapeHtml(entry.label)}</th>${cell(entry)}</tr>`).join('');
+                if (matrix.hosts.length) {
+                    html += `<tr><th>Host / Type</th>${matrix.types.map(t => `<th>${escapeHtml(t)}</th>`).join('')}</tr>`;
+                    html += matrix.hosts.map(host => `<tr><th>${escapeHtml(host)}</th>${matrix.types.map(t => {
+                        const entry = (matrix.cells[host] || {})[t];
+                        return entry ? cell(entry) : '<td class="impact-empty">-</td>';
+                    }).join('')}</tr>`).join('');
+                }
+                document.getElementById('impact-matrix').innerHTML = html;
+                section.style.display = '';
+            } catch (error) {
+                console.error("Error fetching scenarios:", error);
+            }
+        }
+
+        ['filter-googlebot', 'filter-error', 'filter-min-impact', 'filter-sort', 'filter-order'].forEach(id => {
+            document.getElementById(id).addEventListener('change', () => loadResults(1));
+        });
+        if (document.getElementById('filter-device')) {
+            document.getElementById('filter-device').addEventListener('change', () => {
+                loadResults(1);
+                loadImpactMatrix();
+            });
+        }
+        document.getElementById('page-prev').addEventListener('click', () => loadResults(currentPage - 1));
+        document.getElementById('page-next').addEventListener('click', () => loadResults(currentPage + 1));
+        if ({{ 'true' if has_results else 'false' }}) {
+            loadResults(1);
+            loadImpactMatrix();
+        }
+
         function toggleUrlList(radio) {
             const container = document.getElementById('urlListContainer');
             container.style.display = radio.value === 'predefined' ? 'block' : 'none';
@@ -835,9 +2563,12 @@ def index():
     """Renders the main page with current results and status."""
     # Results are sorted at the end of run_playwright_test_suite
     return render_template_string(FLASK_TEMPLATE,
-                                  results=test_results,
+                                  has_results=bool(test_results),
                                   current_url=PAGE_URL, # Pass the currently tested URL
                                   discover_mode=DISCOVER_MODE,
+                                  incremental_mode=INCREMENTAL_MODE,
+                                  scenarios_mode=SCENARIOS_MODE,
+                                  devices=DEVICE_MATRIX,
                                   test_status=test_status,
                                   log_lines=test_log,
                                   predefined_urls=predefined_urls) # Pass the predefined URLs
@@ -845,10 +2576,7 @@ def index():
 @flask_app.route('/start', methods=['POST'])
 def start_tests():
     """Handles the form submission to start a new test run."""
-    global PAGE_URL, DISCOVER_MODE, test_status, test_log, test_results, PREDEFINED_BLOCK_LIST, predefined_urls
-    if test_status == 'running':
-        return "Tests are already in progress.", 429
-
+    global PAGE_URL, DISCOVER_MODE, INCREMENTAL_MODE, SCENARIOS_MODE, test_status, test_log, test_results, PREDEFINED_BLOCK_LIST, predefined_urls
     url = request.form.get('page_url')
     mode = request.form.get('mode')
     url_list = request.form.get('url_list', '').strip()
@@ -860,32 +2588,31 @@ def start_tests():
     if mode == 'predefined' and not url_list:
         return "In 'Predefined List' mode, you must provide at least one URL to block. Please fill in the URL list before starting the tests.", 400
 
-    # Update global config
-    PAGE_URL = url
-    DISCOVER_MODE = (mode == 'discover')
-    
-    if not DISCOVER_MODE and url_list:
-        predefined_urls = [line.strip() for line in url_list.split('\n') if line.strip()]
-        PREDEFINED_BLOCK_LIST = predefined_urls
-    else:
-        predefined_urls = []
-        PREDEFINED_BLOCK_LIST = []
+    with run_start_lock:
+        if test_status in ('starting', 'running'):
+            return "Tests are already in progress.", 429
 
-    test_status = "starting"
-    test_log = ["Test run requested..."]
-    test_results = []
+        # Update global config
+        PAGE_URL = url
+        DISCOVER_MODE = (mode == 'discover')
+        INCREMENTAL_MODE = DISCOVER_MODE and request.form.get('incremental') == 'on'
+        SCENARIOS_MODE = DISCOVER_MODE and request.form.get('scenarios') == 'on'
 
-    # Run Playwright tests in a separate thread to avoid blocking Flask
-    def run_async_tests():
-        global test_status
-        try:
-            asyncio.run(run_playwright_test_suite())
-        except Exception as e:
-            log_message(f"FATAL ERROR running test thread: {e}")
-            test_status = "error"
+        if not DISCOVER_MODE and url_list:
+            predefined_urls = [line.strip() for line in url_list.split('\n') if line.strip()]
+            PREDEFINED_BLOCK_LIST = predefined_urls
+        else:
+            predefined_urls = []
+            PREDEFINED_BLOCK_LIST = []
+
+        # Empty the journal before followers can see the new run, so they never stream the previous one
+        reset_result_exports()
+        test_status = "starting"
+        test_log = ["Test run requested..."]
+        test_results = []
 
-    thread = threading.Thread(target=run_async_tests)
-    thread.start()
+    # Run the tests on the shared browser loop so Flask threads are never blocked
+    browser_loop.submit(run_suite_on_shared_browser())
 
     return redirect(url_for('index'))
 
@@ -896,6 +2623,156 @@ def get_status():
     return {"status": test_status, "log": test_log}
 
 
+@flask_app.route('/metrics')
+def get_metrics():
+    """Prometheus scrape endpoint."""
+    if work_queue is not None:
+        METRIC_QUEUE_DEPTH.set(work_queue.pending_count(), queue="distributed")
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n", 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@flask_app.route('/scenarios')
+def get_scenarios():
+    """API endpoint returning the host x type impact matrix and aggregate scenarios of the last run
+       for one device (?device=, the first configured device by default).
+    """
+    device = request.args.get('device') or None
+    if device is not None and device not in DEVICE_MATRIX:
+        return jsonify({"error": f"Unknown device '{device}'"}), 400
+    return jsonify(build_impact_matrix(device=device))
+
+@flask_app.route('/timings')
+def get_timings():
+    """API endpoint returning the aggregate time breakdown and the per-test waterfalls of the last run."""
+    return jsonify({
+        "summary": build_timing_summary(),
+        "run": run_timings,
+        "tests": [{'prefix': r['prefix'], 'name': r['name'], 'duration_ms': r.get('duration_ms'), 'timings': r.get('timings', [])}
+                  for r in test_results],
+    })
+
+def parse_bool_arg(name):
+    """Reads a true/false query argument; anything else (including missing) means 'no filter'."""
+    value = request.args.get(name, '').lower()
+    return {'true': True, 'false': False}.get(value)
+
+def serialize_result(result):
+    """Result fields sent to the results grid, with screenshot and thumbnail URLs."""
+    data = {key: result.get(key) for key in (
+        'prefix', 'name', 'blocked_item', 'googlebot_allowed', 'error', 'error_class', 'error_message',
+        'impact_score', 'duration_ms', 'timings', 'reused', 'is_googlebot_view', 'device')}
+    if result.get('screenshot_file'):
+        data['screenshot_url'] = url_for('serve_screenshot', filename=result['screenshot_file'])
+        data['thumbnail_url'] = url_for('serve_thumbnail', filename=result['screenshot_file'])
+    data['viewports'] = [{'width': viewport['width'], 'screenshot_url': url_for('serve_screenshot', filename=viewport['screenshot_file'])}
+                         for viewport in result.get('viewport_screenshots', [])]
+    return data
+
+@flask_app.route('/api/results')
+def api_results():
+    """Paginated, sorted and filtered results of the current run.
+       Query arguments: page, per_page, sort (prefix, impact_score, duration_ms, blocked_item),
+       order (asc, desc), googlebot_allowed (true, false), error (true, false), min_impact (0-1), device.
+    """
+    results = list(test_results) # Snapshot: the run may append while we filter
+    googlebot_allowed = parse_bool_arg('googlebot_allowed')
+    error = parse_bool_arg('error')
+    min_impact = request.args.get('min_impact', type=float) or 0.0
+    device = request.args.get('device')
+
+    if googlebot_allowed is not None:
+        results = [r for r in results if r.get('googlebot_allowed') is googlebot_allowed]
+    if error is not None:
+        results = [r for r in results if bool(r.get('error')) is error]
+    if min_impact > 0:
+        results = [r for r in results if (r.get('impact_score') or 0) >= min_impact]
+    if device:
+        results = [r for r in results if r.get('device', "default") == device]
+
+    sort = request.args.get('sort', 'prefix')
+    if sort not in ('prefix', 'impact_score', 'duration_ms', 'blocked_item'):
+        sort = 'prefix'
+    descending = request.args.get('order') == 'desc'
+    present = [r for r in results if r.get(sort) is not None]
+    missing = [r for r in results if r.get(sort) is None]
+    present.sort(key=result_sort_key if sort == 'prefix' else lambda r: r[sort], reverse=descending)
+    results = present + missing # Results without a value always come last
+
+    per_page = max(1, min(request.args.get('per_page', 24, type=int), RESULTS_PER_PAGE_MAX))
+    pages = (len(results) + per_page - 1) // per_page
+    page = max(1, min(request.args.get('page', 1, type=int), max(pages, 1)))
+    page_results = results[(page - 1) * per_page:page * per_page]
+    return jsonify({
+        "status": test_status,
+        "run_total": len(test_results),
+        "total": len(results),
+        "page": page,
+        "pages": pages,
+        "per_page": per_page,
+        "results": [serialize_result(r) for r in page_results],
+    })
+
+def get_thumbnail_path(filename):
+    """Returns the path of a cached JPEG thumbnail for a screenshot, creating it if needed.
+       Returns None if Pillow is not installed or the screenshot cannot be read.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    source_path = os.path.join(OUTPUT_DIR, filename)
+    thumbnail_dir = os.path.join(OUTPUT_DIR, THUMBNAIL_DIR)
+    thumbnail_path = os.path.join(thumbnail_dir, os.path.splitext(filename)[0] + ".jpg")
+    try:
+        if os.path.exists(thumbnail_path) and os.path.getmtime(thumbnail_path) >= os.path.getmtime(source_path):
+            return thumbnail_path
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+        with Image.open(source_path) as image:
+            image = image.convert("RGB")
+            image = image.crop((0, 0, image.width, min(image.height, image.width * 3 // 2)))
+            image.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 3 // 2))
+            tmp_path = f"{thumbnail_path}.{uuid.uuid4().hex}.part"
+            image.save(tmp_path, "JPEG", quality=70)
+        os.replace(tmp_path, thumbnail_path)
+        return thumbnail_path
+    except (OSError, ValueError) as e:
+        print(f"Could not create thumbnail for {filename}: {e}")
+        return None
+
+@flask_app.route('/export/results.jsonl')
+def export_jsonl():
+    """Streams the results journal as JSON lines. With ?follow=1, keeps streaming new results until the run ends."""
+    follow = request.args.get('follow', '').lower() in ('1', 'true')
+    return Response(stream_with_context(iter_journal(follow)), mimetype="application/x-ndjson",
+                    headers={"Content-Disposition": "attachment; filename=results.jsonl"})
+
+@flask_app.route('/export/results.csv')
+def export_csv():
+    """Streams the results journal as CSV. With ?follow=1, keeps streaming new results until the run ends."""
+    follow = request.args.get('follow', '').lower() in ('1', 'true')
+    return Response(stream_with_context(iter_csv_export(follow)), mimetype="text/csv",
+                    headers={"Content-Disposition": "attachment; filename=results.csv"})
+
+@flask_app.route('/export/screenshots.zip')
+def export_zip():
+    """Streams a ZIP of the screenshots and thumbnails recorded so far, with a manifest.jsonl."""
+    return Response(stream_with_context(iter_zip_export()), mimetype="application/zip",
+                    headers={"Content-Disposition": "attachment; filename=screenshots.zip"})
+
+@flask_app.route('/thumbnails/<path:filename>')
+def serve_thumbnail(filename):
+    """Serves a small JPEG preview of a screenshot (the full screenshot if Pillow is missing)."""
+    safe_dir = os.path.abspath(flask_app.config['OUTPUT_DIR'])
+    file_path = os.path.abspath(os.path.join(safe_dir, filename))
+    if not file_path.startswith(safe_dir + os.sep):
+        abort(404)
+    thumbnail_path = get_thumbnail_path(os.path.relpath(file_path, safe_dir))
+    if thumbnail_path is None:
+        return serve_screenshot(filename)
+    return send_from_directory(os.path.abspath(os.path.dirname(thumbnail_path)), os.path.basename(thumbnail_path), max_age=0)
+
 @flask_app.route('/screenshots/<path:filename>')
 def serve_screenshot(filename):
     """Serves the screenshot files from the output directory."""
@@ -914,34 +2791,136 @@ def serve_screenshot(filename):
         print(f"File not found: {filename}")
         abort(404)
 
+@flask_app.before_request
+def check_queue_token():
+    """Broker endpoints only answer workers presenting the shared --queue-token."""
+    if not request.path.startswith('/queue/') or not QUEUE_TOKEN:
+        return None
+    if not hmac.compare_digest(request.headers.get('X-Queue-Token', ''), QUEUE_TOKEN):
+        return jsonify({"error": "Invalid or missing queue token"}), 403
+    return None
+
+@flask_app.route('/queue/claim', methods=['POST'])
+def queue_claim():
+    """Broker endpoint: leases the next queued test to a remote worker."""
+    if work_queue is None:
+        return jsonify({"error": "Distributed mode is not enabled"}), 503
+    worker_id = (request.get_json(silent=True) or {}).get('worker_id')
+    if not worker_id:
+        return jsonify({"error": "worker_id is required"}), 400
+    job = work_queue.claim(worker_id)
+    if job is None:
+        return "", 204
+    return jsonify(job)
+
+@flask_app.route('/queue/jobs/<job_id>/heartbeat', methods=['POST'])
+def queue_heartbeat(job_id):
+    """Broker endpoint: extends the lease of a job being rendered."""
+    if work_queue is None:
+        return jsonify({"error": "Distributed mode is not enabled"}), 503
+    worker_id = (request.get_json(silent=True) or {}).get('worker_id')
+    if not work_queue.heartbeat(job_id, worker_id):
+        return jsonify({"error": "Lease lost"}), 409
+    return jsonify({"ok": True})
+
+@flask_app.route('/queue/jobs/<job_id>/complete', methods=['POST'])
+def queue_complete(job_id):
+    """Broker endpoint: stores the uploaded result and screenshots of a job (first write wins)."""
+    if work_queue is None:
+        return jsonify({"error": "Distributed mode is not enabled"}), 503
+    worker_id = request.form.get('worker_id')
+    try:
+        result = json.loads(request.form.get('result', ''))
+    except ValueError:
+        return jsonify({"error": "Invalid result payload"}), 400
+    if not isinstance(result, dict) or 'error' not in result:
+        return jsonify({"error": "Result payload must be an object with an 'error' field"}), 400
+
+    payload = work_queue.leased_payload(job_id, worker_id)
+    if payload is None:
+        return jsonify({"recorded": False, "error": "Job unknown, already finished or leased to another worker"}), 409
+
+    # Only the screenshot names this job can produce are accepted, so an upload never replaces another file
+    file_stem = screenshot_stem(payload['prefix'], payload['url_to_block'], payload['reason'], payload.get('device', "default"))
+    expected_name = re.compile(re.escape(file_stem) + r"(_ERROR|_\d+w)?\.png")
+    staged = [] # (temporary path, final path)
+    uploaded = {} # form field -> file name
+    try:
+        # 'screenshot' is the main render, 'viewport_<n>' the extra widths of the same page
+        for field, upload in request.files.items():
+            if not upload.filename:
+                continue
+            filename = os.path.basename(upload.filename)
+            if not expected_name.fullmatch(filename):
+                return jsonify({"recorded": False, "error": f"Unexpected file name '{filename}' for job {job_id}"}), 400
+            target_path = os.path.join(flask_app.config['OUTPUT_DIR'], filename)
+            # Write to a temporary file first so a rejected or partial upload never replaces a PNG
+            tmp_path = f"{target_path}.{uuid.uuid4().hex}.part"
+            upload.save(tmp_path)
+            staged.append((tmp_path, target_path))
+            uploaded[field] = filename
+
+        # Identity and file names come from the leased job and the files actually received,
+        # so a worker can neither relabel a result nor point it at another file of the output directory
+        viewport_files = {name for field, name in uploaded.items() if field.startswith('viewport_')}
+        result.update(queued_result_identity(payload))
+        result['error'] = bool(result['error'])
+        result['screenshot_file'] = uploaded.get('screenshot')
+        result['viewport_screenshots'] = [
+            viewport for viewport in result.get('viewport_screenshots') or []
+            if isinstance(viewport, dict) and viewport.get('screenshot_file') in viewport_files
+        ]
+        result.pop('reused', None)
+        log_lines = result.get('log') if isinstance(result.get('log'), list) else []
+        result['log'] = [line for line in log_lines if isinstance(line, str)]
+
+        def move_uploads_into_place():
+            for tmp_path, target_path in staged:
+                os.replace(tmp_path, target_path)
+            staged.clear()
+
+        recorded = work_queue.complete(job_id, worker_id, result, on_recorded=move_uploads_into_place)
+    finally:
+        for tmp_path, _ in staged:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    if not recorded:
+        return jsonify({"recorded": False, "error": "Job already finished or leased to another worker"}), 409
+    return jsonify({"recorded": True})
+
+@flask_app.route('/queue/jobs/<job_id>/fail', methods=['POST'])
+def queue_fail(job_id):
+    """Broker endpoint: a worker could not process a job, so it is retried or marked failed."""
+    if work_queue is None:
+        return jsonify({"error": "Distributed mode is not enabled"}), 503
+    data = request.get_json(silent=True) or {}
+    work_queue.fail(job_id, data.get('worker_id'), data.get('error_message', 'Unknown worker error'))
+    return jsonify({"ok": True})
+
 @flask_app.route('/check_impact', methods=['GET'])
 def check_impact():
     url = request.args.get('url')
     if not url:
         return jsonify({"error": "URL parameter is required"}), 400
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch()
-        page = browser.new_page()
-        
-        # Mesurer le temps de chargement sans bloquer les ressources
-        page.goto(url)
-        normal_timing = page.evaluate('() => ({loadTime: window.performance.timing.loadEventEnd - window.performance.timing.navigationStart})')
-        
-        # Mesurer le temps de chargement en bloquant les ressources
-        context = browser.new_context()
-        page = context.new_page()
-        page.route("**/*.{png,jpg,jpeg,gif,webp,css,js}", lambda route: route.abort())
-        page.goto(url)
-        blocked_timing = page.evaluate('() => ({loadTime: window.performance.timing.loadEventEnd - window.performance.timing.navigationStart})')
-        
-        browser.close()
-        
-        return jsonify({
-            "normal_load_time": normal_timing["loadTime"],
-            "blocked_load_time": blocked_timing["loadTime"],
-            "difference": normal_timing["loadTime"] - blocked_timing["loadTime"]
-        })
+    # Backpressure: refuse new measurements instead of queuing them without bound
+    if not check_impact_slots.acquire(blocking=False):
+        return jsonify({"error": "Too many measurements in progress, retry later"}), 429
+    try:
+        future = browser_loop.submit(measure_load_impact(url))
+        try:
+            normal_load_time, blocked_load_time = future.result(timeout=CHECK_IMPACT_TIMEOUT)
+        except Exception as e:
+            future.cancel()
+            return jsonify({"error": f"Measurement failed: {e}"}), 502
+    finally:
+        check_impact_slots.release()
+
+    return jsonify({
+        "normal_load_time": normal_load_time,
+        "blocked_load_time": blocked_load_time,
+        "difference": normal_load_time - blocked_load_time
+    })
 
 # --- Execution ---
 if __name__ == "__main__":
@@ -949,16 +2928,90 @@ if __name__ == "__main__":
     parser.add_argument('--port', type=int, default=5001, help='Port to run the server on')
     parser.add_argument('--discover', action='store_true', help='Enable discovery mode')
     parser.add_argument('--url', type=str, help='URL to test in discovery mode')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes used to shard individual tests')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='Number of tests run per batch in each worker')
+    parser.add_argument('--distributed', action='store_true', help='Queue individual tests for remote workers instead of running them locally')
+    parser.add_argument('--queue-db', type=str, default=os.path.join(OUTPUT_DIR, 'queue.sqlite3'), help='SQLite file backing the work queue in distributed mode')
+    parser.add_argument('--incremental', action='store_true', help='Discovery mode: only re-render resources whose body or robots.txt verdict changed since the last run')
+    parser.add_argument('--scenarios', action='store_true', help='Discovery mode: also render grouped scenarios (third-party, per resource type, per host x type) and an impact matrix')
+    parser.add_argument('--devices', type=str, default="default", help=f"Comma-separated devices each test is rendered with, among: {', '.join(DEVICES)}")
+    parser.add_argument('--viewports', type=str, default="", help='Comma-separated extra viewport widths captured from the already loaded page (e.g. 360,768,1920)')
+    parser.add_argument('--run', action='store_true', help='Run the tests once from the command line (no web server) and exit')
+    parser.add_argument('--export', action='append', default=[], help='Write results to this .jsonl or .csv file as tests complete, or a .zip of screenshots at the end (repeatable)')
+    parser.add_argument('--production', action='store_true', help='Serve with a production WSGI server (waitress) and without the debug reloader')
+    parser.add_argument('--profile', action='store_true', help='Dump a cProfile of each run to <output dir>/profiles')
+    parser.add_argument('--worker', action='store_true', help='Run as a headless worker pulling tests from a coordinator')
+    parser.add_argument('--coordinator', type=str, default='http://localhost:5001', help='Coordinator base URL used in worker mode')
+    parser.add_argument('--worker-id', type=str, default=None, help='Worker identifier (defaults to hostname-pid)')
+    parser.add_argument('--queue-token', type=str, default=os.environ.get('QUEUE_TOKEN'), help='Shared secret between the coordinator and its workers (defaults to $QUEUE_TOKEN)')
     args = parser.parse_args()
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    QUEUE_TOKEN = args.queue_token
+
+    if args.worker:
+        worker_id = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        try:
+            asyncio.run(run_worker(args.coordinator, worker_id))
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
 
     DISCOVER_MODE = args.discover
     PAGE_URL = args.url
+    WORKERS = max(1, args.workers)
+    CONCURRENCY = max(1, args.concurrency)
+    PROFILE_ENABLED = args.profile
+    INCREMENTAL_MODE = args.incremental
+    SCENARIOS_MODE = args.scenarios
+    DEVICE_MATRIX = [d.strip() for d in args.devices.split(",") if d.strip()] or ["default"]
+    unknown_devices = [d for d in DEVICE_MATRIX if d not in DEVICES]
+    if unknown_devices:
+        print(f"Error: Unknown device(s) {', '.join(unknown_devices)}. Available: {', '.join(DEVICES)}")
+        sys.exit(1)
+    try:
+        VIEWPORT_WIDTHS = sorted({int(w) for w in args.viewports.split(",") if w.strip()})
+    except ValueError:
+        print("Error: --viewports must be a comma-separated list of widths in pixels")
+        sys.exit(1)
+    if args.distributed:
+        work_queue = WorkQueue(args.queue_db)
+        if not QUEUE_TOKEN:
+            print("Warning: --distributed without --queue-token, anyone reaching the server can claim and complete jobs")
 
     if DISCOVER_MODE and not PAGE_URL:
         print("Error: --url is required when --discover is enabled")
         sys.exit(1)
 
-    # Activation du mode debug pour le rechargement automatique
-    flask_app.debug = True
-    flask_app.run(host='0.0.0.0', port=args.port, debug=True)
+    zip_exports = [path for path in args.export if path.endswith(".zip")]
+    export_paths = [path for path in args.export if not path.endswith(".zip")]
+
+    if args.run:
+        if not PAGE_URL:
+            print("Error: --url is required with --run")
+            sys.exit(1)
+        if work_queue is not None:
+            print("Error: --distributed needs the web server for workers, it cannot be used with --run")
+            sys.exit(1)
+        with profiling("run"):
+            success = asyncio.run(run_playwright_test_suite())
+        for path in zip_exports:
+            write_zip_export(path)
+            print(f"Screenshots exported to {path}")
+        sys.exit(0 if success else 1)
+    if zip_exports:
+        print("Note: .zip exports are only written with --run, use /export/screenshots.zip with the web server.")
+
+    if args.production:
+        try:
+            from waitress import serve
+        except ImportError:
+            print("waitress is not installed (pip install waitress), falling back to the threaded Flask server without debug.")
+            flask_app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
+        else:
+            # A single process keeps all state (and the shared browser loop) in one place
+            serve(flask_app, host='0.0.0.0', port=args.port, threads=SERVER_THREADS)
+    else:
+        # Activation du mode debug pour le rechargement automatique
+        flask_app.debug = True
+        flask_app.run(host='0.0.0.0', port=args.port, debug=True)
 
@@ -0,0 +1,98 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import main
+
+
+class FakeRobotsChecker:
+    def check_url_allowed(self, url):
+        return True
+
+
+class WorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.queue = main.WorkQueue(os.path.join(self.tmp.name, "queue.sqlite3"))
+        self.payload = {'page_url': "https://example.com/", 'discover_mode': True, 'url_to_block': "https://example.com/app.js",
+                        'prefix': "01", 'reason': "individual", 'device': "default", 'viewport_widths': []}
+        self.queue.enqueue("run1", [self.payload])
+
+    def tearDown(self):
+        self.queue.conn.close()
+        self.tmp.cleanup()
+
+    def test_expired_lease_is_requeued(self):
+        job = self.queue.claim("worker-a")
+        self.assertEqual(job['attempt'], 1)
+        self.assertIsNone(self.queue.claim("worker-b"))
+        with mock.patch.object(main, "QUEUE_LEASE_SECONDS", -1):
+            requeued = self.queue.claim("worker-b")
+        self.assertEqual(requeued['job_id'], job['job_id'])
+        self.assertEqual(requeued['attempt'], 2)
+        self.assertFalse(self.queue.heartbeat(job['job_id'], "worker-a"))
+
+    def test_first_write_wins(self):
+        job = self.queue.claim("worker-a")
+        self.assertTrue(self.queue.complete(job['job_id'], "worker-a", {'error': False}))
+        self.assertFalse(self.queue.complete(job['job_id'], "worker-a", {'error': True}))
+        [finished] = self.queue.finished_jobs("run1")
+        self.assertEqual(finished['result'], {'error': False})
+
+
+class QueueCompleteEndpointTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.queue = main.WorkQueue(os.path.join(self.tmp.name, "queue.sqlite3"))
+        self.queue.enqueue("run1", [{'page_url': "https://example.com/", 'discover_mode': True, 'url_to_block': "https://example.com/app.js",
+                                     'prefix': "01", 'reason': "individual", 'device': "default", 'viewport_widths': []}])
+        self.job = self.queue.claim("worker-a")
+        self.stem = main.screenshot_stem("01", "https://example.com/app.js", "individual", "default")
+        patches = [mock.patch.object(main, "work_queue", self.queue),
+                   mock.patch.object(main, "QUEUE_TOKEN", "secret"),
+                   mock.patch.object(main, "get_robots_checker", FakeRobotsChecker),
+                   mock.patch.dict(main.flask_app.config, {'OUTPUT_DIR': self.tmp.name})]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.client = main.flask_app.test_client()
+
+    def tearDown(self):
+        self.queue.conn.close()
+        self.tmp.cleanup()
+
+    def complete(self, result, files=None, token="secret"):
+        data = {'worker_id': "worker-a", 'result': json.dumps(result)}
+        data.update(files or {})
+        return self.client.post(f"/queue/jobs/{self.job['job_id']}/complete", data=data,
+                                headers={'X-Queue-Token': token}, content_type="multipart/form-data")
+
+    def test_missing_token_is_rejected(self):
+        self.assertEqual(self.complete({'error': False}, token="wrong").status_code, 403)
+
+    def test_unexpected_file_name_is_rejected(self):
+        response = self.complete({'error': False}, {'screenshot': (io.BytesIO(b"png"), "../secret.txt")})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([n for n in os.listdir(self.tmp.name) if not n.startswith("queue.sqlite3")], [])
+        self.assertEqual(self.queue.finished_jobs("run1"), [])
+
+    def test_result_fields_come_from_the_job_and_uploads(self):
+        result = {'error': False, 'prefix': "99", 'screenshot_file': "../secret.txt",
+                  'viewport_screenshots': [{'width': 360, 'screenshot_file': "../secret.txt"}]}
+        response = self.complete(result, {'screenshot': (io.BytesIO(b"png"), f"{self.stem}.png")})
+        self.assertEqual(response.status_code, 200)
+        [finished] = self.queue.finished_jobs("run1")
+        self.assertEqual(finished['result']['prefix'], "01")
+        self.assertEqual(finished['result']['screenshot_file'], f"{self.stem}.png")
+        self.assertEqual(finished['result']['viewport_screenshots'], [])
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, f"{self.stem}.png")))
+
+    def test_result_without_error_field_is_rejected(self):
+        self.assertEqual(self.complete({'prefix': "01"}).status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()